@@ -1,3 +1,4 @@
+import math
 import torch as th 
 
 class EnsembleFlow:
@@ -5,31 +6,70 @@ class EnsembleFlow:
         self.n_flows = len(flows)
         self.flows = flows
 
-    def log_prob(self, x, condition):
+    @staticmethod
+    def _as_batch(condition):
+        # a single theta of shape (dim_theta,) is treated as a batch of one
+        return condition.unsqueeze(0) if condition.ndim == 1 else condition
+
+    def member_log_probs(self, x, condition):
+        """
+            Log density of x under every flow, stacked along a leading ensemble dim
+                x: (N, batch, dim_x), condition: (batch, dim_theta) or (dim_theta,)
+            returns (n_flows, N, batch)
+        """
         with th.no_grad():
-            log_probs = [flow.log_prob(x, condition.unsqueeze(0)) for flow in self.flows]
-            stacked = th.stack(log_probs, dim=0).mean(dim=0)
-            return stacked
+            condition = self._as_batch(condition)
+            return th.stack([flow.log_prob(x, condition) for flow in self.flows], dim=0)
+
+    def mixture_log_prob(self, member_log_probs):
+        """
+            Log density of the ensemble predictive (uniform mixture of the flows)
+                log q(x|theta) = logsumexp_m(log q_m(x|theta)) - log M
+            computed from stacked member log probs of shape (n_flows, ...)
+        """
+        return th.logsumexp(member_log_probs, dim=0) - math.log(self.n_flows)
+
+    def log_prob_and_member_log_probs(self, x, condition):
+        """
+            Fused evaluation returning both the mixture log density (N, batch) and
+            the per-member log probs (n_flows, N, batch) they were computed from,
+            so acquisitions can reuse the member terms without another pass
+        """
+        member_log_probs = self.member_log_probs(x, condition)
+        return self.mixture_log_prob(member_log_probs), member_log_probs
+
+    def log_prob(self, x, condition):
+        return self.mixture_log_prob(self.member_log_probs(x, condition))
 
     def sample(self, n_samples, condition):
         # generate samples from mixture of flows 
         with th.no_grad():
+            condition = self._as_batch(condition)
             n = n_samples // self.n_flows        
             samples = []
             for flow in self.flows:
-                samples.append(flow.sample((n,), condition.unsqueeze(0)))
+                samples.append(flow.sample((n,), condition))
 
             if n_samples % self.n_flows != 0:
                 remaining_samples = int(n_samples % self.n_flows)
-                samples.append(flow.sample((remaining_samples,), condition.unsqueeze(0)))
+                samples.append(flow.sample((remaining_samples,), condition))
                 
             return th.cat(samples, dim=0)
+
+    def sample_members(self, n_samples, condition):
+        """
+            Draw n_samples from every flow in the ensemble
+            returns samples of shape (n_flows, n_samples, batch, dim_x)
+        """
+        with th.no_grad():
+            condition = self._as_batch(condition)
+            return th.stack([flow.sample((n_samples,), condition) for flow in self.flows], dim=0)
     
     def compute_marginal_entropy(self, theta, N=1000):
         """
             Compute the marginal entropy of the (ensemble) predictive distribution
                 H[ E(q(x|theta, D)) ] = - E_{x~q(x|theta)}[log q(x|theta)]
-            where q is the ensemble predictive distribution (average of the flows)
+            where q is the ensemble predictive distribution (uniform mixture of the flows)
         """
         # compute entropy of the marginal predictive
         samples = self.sample(N, theta)
@@ -49,15 +89,215 @@ class EnsembleFlow:
                 entropies.append(-th.mean(flow.log_prob(samples, theta.unsqueeze(0))))
             return th.mean(th.stack(entropies, dim=0))
 
+    def compute_log_prob_matrix(self, theta, N=1000, return_mixture=False):
+        """
+            Draw N // M samples from each of the M flows and evaluate them under every flow
+            returns log probs of shape (M, M, N // M, batch) where
+                L[i, j] = log q_i(x_j | theta),  x_j ~ q_j(x|theta)
+            with return_mixture, also returns the log density of the ensemble predictive
+            at the same samples (M, N // M, batch), from the same pass over the members
+        """
+        with th.no_grad():
+            condition = self._as_batch(theta)
+            n = max(N // self.n_flows, 1)
+            samples = self.sample_members(n, condition)
+            pooled = samples.reshape(self.n_flows * n, *samples.shape[2:])
+            mixture_log_probs, log_probs = self.log_prob_and_member_log_probs(pooled, condition)
+            log_probs = log_probs.reshape(self.n_flows, self.n_flows, n, -1)
+            if return_mixture:
+                return log_probs, mixture_log_probs.reshape(self.n_flows, n, -1)
+            return log_probs
+
+    def compute_joint_entropies(self, theta, N=1000):
+        """
+            Estimate the marginal entropy and the average member entropy from one
+            shared sample set. Each of the M flows draws N // M samples, which are
+            evaluated under every flow to give the M x M log-prob matrix
+                L[i, j] = log q_i(x_j),  x_j ~ q_j(x|theta)
+            The diagonal gives E[H(q_m)], and averaging over all flows for the pooled
+            samples gives H[E(q)]. Reusing the samples for both terms halves the
+            sampling cost and correlates the two estimates, reducing the variance
+            of their difference.
+            returns (marginal_entropy, ensemble_entropy), each of shape (batch,)
+        """
+        with th.no_grad():
+            # log density of the ensemble predictive at the pooled mixture samples,
+            # computed with the member log probs in one pass
+            log_probs, mixture_log_probs = self.compute_log_prob_matrix(theta, N, return_mixture=True)
+            marginal_entropy = - mixture_log_probs.mean(dim=(0, 1))
+            # each member's log density at its own samples: (n, batch, M)
+            member_log_probs = th.diagonal(log_probs, dim1=0, dim2=1)
+            ensemble_entropy = - member_log_probs.mean(dim=(0, 2))
+            return marginal_entropy, ensemble_entropy
+
     def compute_bald_score(self, theta, N=1000):
         """
             Compute BatchBALD score: H[x | theta, D] - E[H[x | theta, phi]]
         """
-        # entropy of marginal predictive + average entropy of the ensemble
-        marginal_entropy = self.compute_marginal_entropy(theta, N)
-        ensemble_entropy = self.compute_ensemble_entropy(theta, N)
-        bald_score = ensemble_entropy - marginal_entropy
-        return bald_score
+        # entropy of marginal predictive - average entropy of the ensemble
+        marginal_entropy, ensemble_entropy = self.compute_joint_entropies(theta, N)
+        bald_score = marginal_entropy - ensemble_entropy
+        return bald_score.squeeze(0)
+
+    def compute_bald_scores(self, theta_pool, N=1000, chunk_size=256):
+        """
+            Compute the BALD score of every theta in the pool in batched passes.
+            The pool is split into chunks of chunk_size thetas so that memory stays
+            bounded (chunk_size x N samples per flow) for large pools.
+            returns scores of shape (len(theta_pool),)
+        """
+        scores = []
+        for thetas in th.split(theta_pool, chunk_size, dim=0):
+            marginal_entropy, ensemble_entropy = self.compute_joint_entropies(thetas, N)
+            scores.append(marginal_entropy - ensemble_entropy)
+        return th.cat(scores, dim=0)
     
     def compute_batch_bald_score(self, theta, N=1000):
-        pass
\ No newline at end of file
+        """
+            Compute the BatchBALD score of a batch of thetas (k, dim_theta), i.e. the
+            mutual information between the joint outputs and the ensemble member
+                H[x_1:k | theta_1:k, D] - E[H[x_1:k | theta_1:k, phi]]
+            Given a member the outputs are independent, so the member term is the sum of
+            the single-theta entropies while the marginal term uses the joint density
+                q(x_1:k) = 1/M sum_m prod_i q_m(x_i | theta_i)
+        """
+        log_probs = self.compute_log_prob_matrix(theta, N)
+        marginal_entropy, ensemble_entropy = self.joint_entropies_from_log_probs(log_probs)
+        return marginal_entropy - ensemble_entropy
+
+    def joint_entropies_from_log_probs(self, log_probs):
+        """
+            Joint marginal and summed member entropies of a batch from the stacked
+            log-prob matrices of its thetas (M, M, n, k), see compute_log_prob_matrix
+        """
+        joint_log_probs = log_probs.sum(dim=-1)
+        marginal_entropy = - self.mixture_log_prob(joint_log_probs).mean()
+        ensemble_entropy = - th.diagonal(log_probs, dim1=0, dim2=1).mean(dim=(0, 2)).sum()
+        return marginal_entropy, ensemble_entropy
+
+class StackedEnsembleFlow(EnsembleFlow):
+    """
+        Ensemble of sbi MAF flows (nflows backend, density_estimator="maf") whose weights
+        are stacked along a leading ensemble dim, so that log_prob and sample for all
+        members are evaluated together with batched matmuls (one kernel per layer
+        instead of one per layer and member). The stacked weights are copies, so the
+        original networks are not needed (and not deep-copied) afterwards.
+        Drop-in replacement for EnsembleFlow in the acquisition functions.
+    """
+    def __init__(self, flows) -> None:
+        from nflows.transforms.autoregressive import MaskedAffineAutoregressiveTransform
+        from nflows.transforms.permutations import Permutation
+        from nflows.transforms.standard import PointwiseAffineTransform
+
+        super().__init__(flows)
+        with th.no_grad():
+            nets = [flow.net for flow in flows]
+            self.embedding_nets = [net._embedding_net for net in nets]
+            self.dim_x = flows[0].input_shape.numel()
+
+            self.layers = []
+            for transforms in zip(*[net._transform._transforms for net in nets]):
+                transform = transforms[0]
+                if isinstance(transform, PointwiseAffineTransform):
+                    self.layers.append(('affine', {
+                        'shift': th.stack([t._shift.expand(self.dim_x) for t in transforms]),
+                        'scale': th.stack([t._scale.expand(self.dim_x) for t in transforms]),
+                    }))
+                elif isinstance(transform, Permutation):
+                    self.layers.append(('permutation', {
+                        'permutation': th.stack([t._permutation for t in transforms]),
+                    }))
+                elif isinstance(transform, MaskedAffineAutoregressiveTransform) and not transform.autoregressive_net.use_residual_blocks:
+                    self.layers.append(('made', self._stack_made([t.autoregressive_net for t in transforms])))
+                    self.layers[-1][1]['epsilon'] = transform._epsilon
+                else:
+                    raise NotImplementedError(f'StackedEnsembleFlow does not support {type(transform).__name__}')
+
+    @staticmethod
+    def _stack_linear(layers, masked=True):
+        # weights as (M, in, out) so that h @ W is a batched matmul over members
+        weight = th.stack([(l.weight * l.mask if masked else l.weight).T for l in layers])
+        bias = th.stack([l.bias for l in layers]).unsqueeze(1)
+        return weight, bias
+
+    def _stack_made(self, mades):
+        for made in mades:
+            if any(block.batch_norm for block in made.blocks):
+                raise NotImplementedError('StackedEnsembleFlow does not support batch norm in MADE')
+        return {
+            'activation': mades[0].activation,
+            'initial': self._stack_linear([m.initial_layer for m in mades]),
+            'context': self._stack_linear([m.context_layer for m in mades], masked=False),
+            'blocks': [self._stack_linear([m.blocks[i].linear for m in mades]) for i in range(len(mades[0].blocks))],
+            'final': self._stack_linear([m.final_layer for m in mades]),
+        }
+
+    @staticmethod
+    def _made(params, h, context):
+        # stacked MADE forward, h: (M, rows, dim_x), context: (M, rows, dim_context)
+        activation = params['activation']
+        temps = th.baddbmm(params['initial'][1], h, params['initial'][0])
+        temps = activation(temps + activation(th.baddbmm(params['context'][1], context, params['context'][0])))
+        for weight, bias in params['blocks']:
+            temps = activation(th.baddbmm(bias, temps, weight))
+        outputs = th.baddbmm(params['final'][1], temps, params['final'][0])
+        outputs = outputs.reshape(*h.shape, 2)
+        scale = th.nn.functional.softplus(outputs[..., 0]) + params['epsilon']
+        return scale, outputs[..., 1]
+
+    def _forward(self, h, context):
+        # x -> noise through all layers, returns noise and log|det J|: (M, rows)
+        logabsdet = th.zeros(h.shape[:2], dtype=h.dtype, device=h.device)
+        for kind, params in self.layers:
+            if kind == 'affine':
+                h = h * params['scale'].unsqueeze(1) + params['shift'].unsqueeze(1)
+                logabsdet = logabsdet + th.log(params['scale']).sum(dim=-1, keepdim=True)
+            elif kind == 'permutation':
+                h = th.gather(h, 2, params['permutation'].unsqueeze(1).expand_as(h))
+            else:
+                scale, shift = self._made(params, h, context)
+                h = scale * h + shift
+                logabsdet = logabsdet + th.log(scale).sum(dim=-1)
+        return h, logabsdet
+
+    def _inverse(self, h, context):
+        # noise -> x through all layers in reverse order
+        for kind, params in reversed(self.layers):
+            if kind == 'affine':
+                h = (h - params['shift'].unsqueeze(1)) / params['scale'].unsqueeze(1)
+            elif kind == 'permutation':
+                inverse_permutation = th.argsort(params['permutation'], dim=-1)
+                h = th.gather(h, 2, inverse_permutation.unsqueeze(1).expand_as(h))
+            else:
+                # autoregressive inverse needs one pass per dimension
+                outputs = th.zeros_like(h)
+                for _ in range(self.dim_x):
+                    scale, shift = self._made(params, outputs, context)
+                    outputs = (h - shift) / scale
+                h = outputs
+        return h
+
+    def _embed(self, condition):
+        # each member embeds the (shared) condition: (M, batch, dim_context)
+        return th.stack([embedding_net(condition) for embedding_net in self.embedding_nets])
+
+    def member_log_probs(self, x, condition):
+        with th.no_grad():
+            condition = self._as_batch(condition)
+            n, batch = x.shape[0], x.shape[1]
+            context = self._embed(condition)
+            context = context.unsqueeze(1).expand(-1, n, -1, -1).reshape(self.n_flows, n * batch, -1)
+            h = x.reshape(1, n * batch, self.dim_x).expand(self.n_flows, -1, -1)
+            noise, logabsdet = self._forward(h, context)
+            log_probs = -0.5 * (noise ** 2).sum(dim=-1) - 0.5 * self.dim_x * math.log(2 * math.pi) + logabsdet
+            return log_probs.reshape(self.n_flows, n, batch)
+
+    def sample_members(self, n_samples, condition):
+        with th.no_grad():
+            condition = self._as_batch(condition)
+            batch = condition.shape[0]
+            context = self._embed(condition)
+            context = context.unsqueeze(1).expand(-1, n_samples, -1, -1).reshape(self.n_flows, n_samples * batch, -1)
+            noise = th.randn(self.n_flows, n_samples * batch, self.dim_x, device=context.device)
+            samples = self._inverse(noise, context)
+            return samples.reshape(self.n_flows, n_samples, batch, self.dim_x)
@@ -1,24 +1,124 @@
+import time
 import torch as th 
 from copy import deepcopy 
-from asbi.algorithms.EnsembleFlow import EnsembleFlow
+from asbi.algorithms.EnsembleFlow import EnsembleFlow, StackedEnsembleFlow
+from asbi.algorithms.timing import timer
 
-def bald_acq_func(ensemble, theta_pool, k=1):
+def get_ensemble_flow(ensemble, stacked=False):
+    """
+     Build the ensemble predictive from a list of trained sbi inference objects
+     the flows are used read-only (eval mode, no_grad) and share their parameters with
+     the trained networks, so nothing is copied.
+     stacked=True evaluates all members at once with stacked weights (StackedEnsembleFlow)
+    """
+    flows = [inference._neural_net.eval() for inference in ensemble]
+    if stacked:
+        return StackedEnsembleFlow(flows)
+    return EnsembleFlow(flows)
+
+class EnsembleView:
+    """
+     Cached read-only view of an ensemble for repeated acquisitions.
+     The view is rebuilt only when a member network is replaced (e.g. after parallel
+     training) or, for stacked views that hold copies of the weights, when the weights
+     changed in place (tracked through the parameters' version counters).
+     It also keeps track of the network copies that are no longer made per acquisition.
+    """
+    def __init__(self, stacked=False) -> None:
+        self.stacked = stacked
+        self.flow = None
+        self.nets = None
+        self.versions = None
+        self.n_requests = 0
+        self.n_builds = 0
+        self.build_time = 0.
+        self.copy_time = None
+
+    @staticmethod
+    def _versions(nets):
+        return [sum(p._version for p in net.parameters()) for net in nets]
+
+    def get(self, ensemble):
+        nets = [inference._neural_net for inference in ensemble]
+        self.n_requests += 1
+
+        replaced = self.nets is None or len(nets) != len(self.nets) or any(a is not b for a, b in zip(nets, self.nets))
+        changed = self.stacked and not replaced and self._versions(nets) != self.versions
+        if replaced or changed:
+            if self.copy_time is None:
+                # one-off reference: what the per-acquisition deepcopy used to cost
+                start = time.time()
+                _ = [deepcopy(net) for net in nets]
+                self.copy_time = time.time() - start
+
+            start = time.time()
+            with timer.stage('acquire/view_build'):
+                self.flow = get_ensemble_flow(ensemble, stacked=self.stacked)
+            self.build_time += time.time() - start
+            self.nets = nets
+            self.versions = self._versions(nets)
+            self.n_builds += 1
+        return self.flow
+
+    @property
+    def copy_time_saved(self):
+        if self.copy_time is None:
+            return 0.
+        return self.copy_time * self.n_requests - self.build_time
+
+def bald_acq_func(ensemble, theta_pool, k=1, chunk_size=256, stacked=False, view=None):
     """
      Bayesian Active Learning by Disagreement (BALD)
      returns the theta values with highest bald score (along w/ the scores)
+     the whole pool is scored in batched passes of chunk_size thetas
+     pass an EnsembleView to reuse the ensemble predictive across acquisitions
     """
-    flows = [deepcopy(inference._neural_net) for inference in ensemble]
-    ensemble = EnsembleFlow(flows)
-    scores = []
-    for theta in theta_pool:
-        score = ensemble.compute_bald_score(theta)
-        scores.append(score)
+    ensemble = view.get(ensemble) if view is not None else get_ensemble_flow(ensemble, stacked=stacked)
+    with timer.stage('acquire/score_pool'):
+        scores = ensemble.compute_bald_scores(theta_pool, chunk_size=chunk_size)
+    timer.count('acquire/pool_thetas_scored', len(theta_pool))
     # select theta values with the highest score
-    sorted_scores, sorted_indices = th.sort(th.stack(scores, dim=0), descending=True)
+    sorted_scores, sorted_indices = th.sort(scores, descending=True)
     return theta_pool[sorted_indices[:k]], sorted_scores[:k]
 
-def batch_bald_acq_func(ensemble, theta_pool, k=1):
-    pass
+def batch_bald_acq_func(ensemble, theta_pool, k=1, chunk_size=256, N=1000, stacked=False, view=None):
+    """
+     Greedy BatchBALD: selects k theta values that jointly maximise the mutual
+     information between their outputs and the ensemble member.
+     the per-member log-prob tensors of the whole pool are computed once and cached,
+     each greedy step then only sums cached terms (no extra flow evaluations)
+     returns the selected theta values (along w/ the joint score after each pick)
+    """
+    ensemble = view.get(ensemble) if view is not None else get_ensemble_flow(ensemble, stacked=stacked)
+
+    # cached log-prob matrices for the pool: (M, M, n, pool_size)
+    with timer.stage('acquire/score_pool'):
+        log_probs = th.cat([ensemble.compute_log_prob_matrix(thetas, N) for thetas in th.split(theta_pool, chunk_size, dim=0)], dim=-1)
+    timer.count('acquire/pool_thetas_scored', len(theta_pool))
+    member_entropies = - th.diagonal(log_probs, dim1=0, dim2=1).mean(dim=(0, 2))
+
+    # running sums over the selected batch
+    # kept on the device of the ensemble
+    batch_log_probs = log_probs.new_zeros(log_probs.shape[:-1])
+    batch_member_entropy = 0.
+    available = th.ones(len(theta_pool), dtype=th.bool, device=log_probs.device)
+    selected, scores = [], []
+    with timer.stage('acquire/greedy_select'):
+        for _ in range(min(k, len(theta_pool))):
+            # joint score of the current batch extended by every candidate in the pool
+            candidate_log_probs = batch_log_probs.unsqueeze(-1) + log_probs
+            marginal_entropy = - ensemble.mixture_log_prob(candidate_log_probs).mean(dim=(0, 1))
+            candidate_scores = marginal_entropy - (batch_member_entropy + member_entropies)
+            candidate_scores[~available] = -float('inf')
+
+            idx = th.argmax(candidate_scores)
+            selected.append(idx)
+            scores.append(candidate_scores[idx])
+            available[idx] = False
+            batch_log_probs = batch_log_probs + log_probs[..., idx]
+            batch_member_entropy = batch_member_entropy + member_entropies[idx]
+
+    return theta_pool[th.stack(selected).to(theta_pool.device)], th.stack(scores)
 
 def stochastic_bald_acq_func(ensemble, theta_pool, k=1):
     pass
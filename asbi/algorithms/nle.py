@@ -1,41 +1,91 @@
 import sbi 
+import time
 import torch as th
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
 from sbi.inference import NLE
 from sbi.inference import EnsemblePosterior
-from asbi.algorithms.acquisitions import bald_acq_func
+from asbi.algorithms.acquisitions import bald_acq_func, batch_bald_acq_func, EnsembleView
+from asbi.algorithms.training import warm_start_train, train_ensemble, EnsembleWorkers
+from asbi.algorithms.timing import timer
 
-def run_NLE(simulator, prior, n_sims, density_estimator="maf", device=None):
+# simulator of an async simulation worker process, built once by _init_simulation_worker
+_worker_simulator = None
+
+def _init_simulation_worker(simulator, build_simulator):
+    """
+     Set up an async simulation worker: its own simulator, built from build_simulator if given
+    """
+    global _worker_simulator
+    th.set_num_threads(1)
+    _worker_simulator = build_simulator() if build_simulator is not None else simulator
+
+def _simulate_in_worker(theta, seed):
+    """
+     Simulate theta in an async simulation worker, returns x and the simulation time
+    """
+    start = time.perf_counter()
+    x = simulate_seeded(_worker_simulator, theta, seed)
+    return x, time.perf_counter() - start
+
+def simulate_seeded(simulator, theta, seed):
+    """
+     Simulate theta under its own seed, leaving the global torch random state untouched
+    """
+    with th.random.fork_rng(devices=[]):
+        th.manual_seed(seed)
+        return simulator(theta)
+
+def simulate_initial_data(simulator, prior, n_sims):
+    """
+     Draws n_sims parameters from the prior and simulates them
+    """
+    theta = prior((n_sims,))
+    with timer.stage('simulate'):
+        x = simulator(theta)
+    timer.count('simulations', n_sims)
+    return theta, x
+
+def run_NLE(simulator, prior, n_sims, density_estimator="maf", device=None, initial_data=None):
     """
      Runs neural likelihood estimation 
      for now, we generate the data from the simulator inside the function 
+     unless initial_data = (theta, x) is given (e.g. a prefix of a shared simulation bank)
     """
     if device is None:
         device = th.device("cuda" if th.cuda.is_available() else "cpu")
 
     inference = NLE(prior, density_estimator=density_estimator)
-    theta = prior((n_sims,))
-    x = simulator(theta)
-    _ = inference.append_simulations(theta, x).train()
-    posterior = inference.build_posterior()
+    theta, x = initial_data if initial_data is not None else simulate_initial_data(simulator, prior, n_sims)
+    with timer.stage('train'):
+        _ = inference.append_simulations(theta, x).train()
+    with timer.stage('build_posterior'):
+        posterior = inference.build_posterior()
 
     return posterior
 
-def run_ensemble_NLE(simulator, prior, n_sims, n_ensemble_members=3, density_estimator="maf", device=None):
+def run_ensemble_NLE(simulator, prior, n_sims, n_ensemble_members=3, density_estimator="maf", device=None, n_workers=1, initial_data=None):
     """
      Runs neural likelihood estimation 
      for now, we generate the data from the simulator inside the function 
+     unless initial_data = (theta, x) is given (e.g. a prefix of a shared simulation bank)
+     members are trained in n_workers parallel processes (see train_ensemble)
     """
     if device is None:
         device = th.device("cuda" if th.cuda.is_available() else "cpu")
 
-    ensemble = [NLE(prior, density_estimator=density_estimator) for _ in range(n_ensemble_members)]
-    theta = prior((n_sims,))
-    x = simulator(theta)
-    for inference in ensemble:
-        _ = inference.append_simulations(theta, x).train()
+    build_member = partial(NLE, prior, density_estimator=density_estimator)
+    ensemble = [build_member() for _ in range(n_ensemble_members)]
+    theta, x = initial_data if initial_data is not None else simulate_initial_data(simulator, prior, n_sims)
+    with timer.stage('train'):
+        ensemble = train_ensemble(ensemble, theta, x, n_workers=n_workers, build_member=build_member)
 
-    posteriors = [inference.build_posterior() for inference in ensemble]
-    ensemble_posterior = EnsemblePosterior(posteriors)
+    with timer.stage('build_posterior'):
+        posteriors = [inference.build_posterior() for inference in ensemble]
+        ensemble_posterior = EnsemblePosterior(posteriors)
 
     return ensemble_posterior
 
@@ -46,38 +96,140 @@ def run_bald_NLE(simulator,
                  theta_pool_size,
                  n_ensemble_members, 
                  density_estimator="maf", 
-                 device=None):
+                 device=None,
+                 chunk_size=256,
+                 warm_start=False,
+                 n_finetune_steps=100,
+                 finetune_batch_size=200,
+                 full_retrain_every=None,
+                 acquisition_batch_size=1,
+                 n_workers=1,
+                 stacked_ensemble=False,
+                 initial_data=None,
+                 async_simulation=False,
+                 n_sim_workers=1,
+                 max_staleness=1,
+                 build_simulator=None):
+    """
+     Runs neural likelihood estimation with BALD active learning
+     each round acquires acquisition_batch_size thetas (greedy BatchBALD if > 1),
+     so n_sims_active simulations take ceil(n_sims_active / acquisition_batch_size) rounds.
+     if warm_start is set, each active round fine-tunes the members for n_finetune_steps
+     on a replay mix of new and old data instead of retraining on the whole dataset.
+     every full_retrain_every rounds (if given) the members are trained to convergence
+     full trainings run the members in n_workers parallel processes that keep them resident
+     for the whole run (see EnsembleWorkers)
+     stacked_ensemble scores acquisitions with stacked member weights (see StackedEnsembleFlow)
+     initial_data = (theta, x), if given, replaces the n_sims_init initial prior simulations
+     with async_simulation, acquired thetas are simulated in n_sim_workers background processes
+     while the ensemble trains on the simulations that already arrived. at most max_staleness
+     acquisitions are in flight ahead of the training data, older ones are waited for.
+     the workers build their simulator with build_simulator (a picklable callable, needed for
+     simulators that cannot be pickled) or get a pickled copy of simulator. processes keep
+     simulators that must run on a main thread (julia backends) safe.
+     every acquisition is simulated under its own seed, drawn from the (cell-seeded) global
+     torch rng once plus the acquisition index, so sync and async runs simulate the same data
+    """
 
     if device is None:
         device = th.device("cuda" if th.cuda.is_available() else "cpu")
 
     # intialize ensemble
-    ensemble = [NLE(prior, density_estimator=density_estimator) for _ in range(n_ensemble_members)]
+    build_member = partial(NLE, prior, density_estimator=density_estimator)
+    ensemble = [build_member() for _ in range(n_ensemble_members)]
 
-    theta_init = prior((n_sims_init,))
-    x_init = simulator(theta_init)
+    if initial_data is not None:
+        theta_init, x_init = initial_data
+    else:
+        theta_init, x_init = simulate_initial_data(simulator, prior, n_sims_init)
 
-    # train ensemble on inital data
-    for inference in ensemble:
-        _ = inference.append_simulations(theta_init, x_init).train() 
-        print(' --- training complete --- ')
+    # one set of worker processes for all trainings of the run, closed at the end
+    workers = EnsembleWorkers(build_member, min(n_workers, n_ensemble_members)) if n_workers > 1 else None
+    with ExitStack() as stack:
+        if workers is not None:
+            stack.enter_context(workers)
+        # train ensemble on inital data
+        with timer.stage('train'):
+            ensemble = train_ensemble(ensemble, theta_init, x_init, workers=workers)
     
-    # the rest of the simulations will be used for active learning
-    for i in range(n_sims_active):
-        theta_pool = prior((theta_pool_size,)) 
-        theta_star, _ = bald_acq_func(ensemble, theta_pool, k=1)
-        x_star = simulator(theta_star)
-        for inference in ensemble:
-            _ = inference.append_simulations(theta_star, x_star).train()
-            print(' --- training complete --- ')
+        # the rest of the simulations will be used for active learning
+        # read-only view of the members, rebuilt only when the networks change
+        view = EnsembleView(stacked=stacked_ensemble)
+        executor = None
+        if async_simulation:
+            executor = ProcessPoolExecutor(n_sim_workers, mp_context=get_context('spawn'), initializer=_init_simulation_worker,
+                                           initargs=(simulator if build_simulator is None else None, build_simulator))
+            # shut down at the end of the run, simulations still in flight are cancelled if it fails
+            stack.callback(executor.shutdown, cancel_futures=True)
+        # seeds of the acquisitions' simulations, independent of when and where they run
+        simulation_seed = int(th.randint(2**31 - 1, (1,)))
+        pending = deque()
+        n_trainings = 0
+        n_rounds = -(-n_sims_active // acquisition_batch_size)
+        for i in range(n_rounds):
+            k = min(acquisition_batch_size, n_sims_active - i * acquisition_batch_size)
+            theta_pool = prior((theta_pool_size,)) 
+            with timer.stage('acquire'):
+                if k == 1:
+                    theta_star, _ = bald_acq_func(ensemble, theta_pool, k=1, chunk_size=chunk_size, view=view)
+                else:
+                    theta_star, _ = batch_bald_acq_func(ensemble, theta_pool, k=k, chunk_size=chunk_size, view=view)
+            timer.count('simulations', len(theta_star))
+
+            seed = (simulation_seed + i) % 2**31
+            if executor is None:
+                with timer.stage('simulate'):
+                    arrived = [(theta_star, simulate_seeded(simulator, theta_star, seed))]
+            else:
+                # simulation time is measured in the worker processes, waiting time in the main process
+                pending.append((theta_star, executor.submit(_simulate_in_worker, theta_star, seed)))
+                # collect finished simulations in acquisition order, waiting for the oldest ones
+                # once more than max_staleness are in flight (and for all of them in the last round)
+                arrived = []
+                while pending and (len(pending) > max_staleness or pending[0][1].done() or i == n_rounds - 1):
+                    theta_done, future = pending.popleft()
+                    with timer.stage('wait_simulation'):
+                        x_done, seconds = future.result()
+                    timer.add('simulate', seconds)
+                    arrived.append((theta_done, x_done))
+                if not arrived:
+                    continue
+
+            theta_new = th.cat([theta for theta, _ in arrived])
+            x_new = th.cat([x for _, x in arrived])
+            full_retrain = not warm_start or (full_retrain_every is not None and (n_trainings + 1) % full_retrain_every == 0)
+            if full_retrain:
+                with timer.stage('train'):
+                    ensemble = train_ensemble(ensemble, theta_new, x_new, workers=workers)
+            else:
+                with timer.stage('finetune'):
+                    for inference in ensemble:
+                        _ = warm_start_train(inference, theta_new, x_new, n_steps=n_finetune_steps, batch_size=finetune_batch_size)
+                if workers is not None:
+                    # the workers receive the data and the fine-tuned weights with the next training
+                    workers.record_finetune(theta_new, x_new)
+            n_trainings += 1
+
+        if executor is not None:
+            print(f'async simulation: {n_trainings} trainings for {n_rounds} acquisitions')
+
+    if view.n_requests > 0:
+        print(f'ensemble view: {view.n_builds} builds for {view.n_requests} acquisitions, '
+              f'{view.copy_time_saved:.3f}s of network copies saved')
 
     print('building ensemble posterior...') 
-    posteriors = [inference.build_posterior() for inference in ensemble]
-    ensemble_posterior = EnsemblePosterior(posteriors)
+    with timer.stage('build_posterior'):
+        posteriors = [inference.build_posterior() for inference in ensemble]
+        ensemble_posterior = EnsemblePosterior(posteriors)
     
     print('done!')
     return ensemble_posterior
 
-def run_batch_bald_NLE(simulator, prior, n_sims_init, n_sims_active, theta_pool_size, n_ensemble_members, density_estimator="maf"):
-    pass
+def run_batch_bald_NLE(simulator, prior, n_sims_init, n_sims_active, theta_pool_size, n_ensemble_members, acquisition_batch_size, density_estimator="maf", **kwargs):
+    """
+     Runs neural likelihood estimation with greedy BatchBALD active learning
+     (run_bald_NLE acquiring acquisition_batch_size thetas per round)
+    """
+    return run_bald_NLE(simulator, prior, n_sims_init, n_sims_active, theta_pool_size, n_ensemble_members,
+                        density_estimator=density_estimator, acquisition_batch_size=acquisition_batch_size, **kwargs)
 
@@ -0,0 +1,84 @@
+import sys
+import time
+import resource
+import threading
+import torch as th
+from collections import defaultdict
+from contextlib import contextmanager
+
+class StageTimer:
+    """
+     Accumulates wall-clock time and call counts per named stage, plus free counters
+     (e.g. number of simulations). one process-wide instance (timer) is shared by the
+     algorithms and the experiment runner, which resets and reads it per grid cell.
+     stages timed from several threads add up their times, times measured in worker
+     processes (async simulation) are added with add()
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.times = defaultdict(float)
+            self.calls = defaultdict(int)
+            self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.times[name] += elapsed
+                self.calls[name] += 1
+
+    def add(self, name, seconds, calls=1) -> None:
+        """
+         Add time measured elsewhere (e.g. in a worker process) to stage name
+        """
+        with self._lock:
+            self.times[name] += seconds
+            self.calls[name] += calls
+
+    def count(self, name, n=1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self):
+        """
+         Rows of (stage or counter name, seconds, calls / count)
+        """
+        with self._lock:
+            rows = [{'name': name, 'seconds': self.times[name], 'count': self.calls[name]} for name in self.times]
+            rows += [{'name': name, 'seconds': None, 'count': count} for name, count in self.counters.items()]
+        return rows
+
+# process-wide timer
+timer = StageTimer()
+
+def reset_peak_memory() -> None:
+    """
+     Reset the peak memory of the process, so that peak_memory() covers what runs next:
+     the peak resident set size (linux only, elsewhere it stays the peak since process
+     start) and the peak cuda memory allocated by torch
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+    if th.cuda.is_available():
+        th.cuda.reset_peak_memory_stats()
+
+def peak_memory():
+    """
+     Peak resident set size and peak cuda memory allocated (None without cuda) in MiB
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macos, kilobytes elsewhere
+    max_rss_mb = max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+    max_cuda_mb = th.cuda.max_memory_allocated() / 2**20 if th.cuda.is_available() else None
+    return {'max_rss_mb': max_rss_mb, 'max_cuda_mb': max_cuda_mb}
@@ -0,0 +1,173 @@
+import os
+import torch as th
+import torch.multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from torch.nn.utils import clip_grad_norm_
+
+
+def warm_start_train(inference, theta_new, x_new, n_steps=100, batch_size=200, learning_rate=5e-4, clip_max_norm=5.0):
+    """
+     Fine-tune an already trained sbi inference object on newly acquired simulations
+     resumes from the current network weights and runs a bounded number of gradient
+     steps. each minibatch holds all new points plus a random replay of old points,
+     so the cost per active round does not grow with the dataset size.
+     the new simulations are appended to the inference object so that a later full
+     .train() (and build_posterior) still sees the complete dataset
+    """
+    # nothing to replay if the member has no earlier simulations (get_simulations fails then)
+    theta_old, x_old = None, None
+    if inference._theta_roundwise:
+        theta_old, x_old, _ = inference.get_simulations()
+    inference.append_simulations(theta_new, x_new)
+
+    net = inference._neural_net
+    device = next(net.parameters()).device
+    optimizer = th.optim.Adam(net.parameters(), lr=learning_rate)
+    n_replay = max(batch_size - len(theta_new), 0) if theta_old is not None and len(theta_old) > 0 else 0
+
+    # batches are built on the device of the net (old simulations may be stored elsewhere)
+    theta_new, x_new = theta_new.to(device), x_new.to(device)
+
+    net.train()
+    for _ in range(n_steps):
+        theta_batch, x_batch = theta_new, x_new
+        if n_replay > 0:
+            idx = th.randint(len(theta_old), (n_replay,))
+            theta_batch = th.cat([theta_new, theta_old[idx].to(device)], dim=0)
+            x_batch = th.cat([x_new, x_old[idx].to(device)], dim=0)
+
+        optimizer.zero_grad()
+        loss = th.mean(inference._loss(theta_batch, x_batch))
+        loss.backward()
+        if clip_max_norm is not None:
+            clip_grad_norm_(net.parameters(), max_norm=clip_max_norm)
+        optimizer.step()
+    net.eval()
+    net.zero_grad(set_to_none=True)
+
+    return net
+
+
+# members resident in an EnsembleWorkers process, keyed by their index in the ensemble
+_resident_members = {}
+_resident_build_member = None
+
+def _init_member_worker(build_member, torch_threads):
+    global _resident_build_member
+    th.set_num_threads(torch_threads)
+    _resident_build_member = build_member
+
+def _train_resident_member(idx, theta, x, state_dict, seed, train_kwargs):
+    """
+     Worker for EnsembleWorkers: appends the new simulations to the resident member idx
+     (built on first use), optionally loads weights changed in the parent, trains it and
+     returns the trained weights
+    """
+    inference = _resident_members.get(idx)
+    if inference is None:
+        inference = _resident_members[idx] = _resident_build_member()
+    if state_dict is not None:
+        inference._neural_net.load_state_dict(state_dict)
+    th.manual_seed(seed)
+    _ = inference.append_simulations(theta, x).train(**train_kwargs)
+    return {name: tensor.detach().cpu() for name, tensor in inference._neural_net.state_dict().items()}
+
+class EnsembleWorkers:
+    """
+     Persistent worker processes that keep the ensemble members resident for a whole run.
+     member m lives in worker m % n_workers, which holds its network and all its data, so a
+     training round only sends the new (theta, x) and returns the trained state_dicts.
+     the parent members mirror the data and load the returned weights, so they can be
+     fine-tuned (see warm_start_train) and turned into posteriors as usual.
+     each worker is a single-process pool started once and capped at torch_threads threads
+     (default: cpu_count // n_workers). use as a context manager or call close().
+    """
+    def __init__(self, build_member, n_workers, torch_threads=None) -> None:
+        if torch_threads is None:
+            torch_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        self.n_workers = n_workers
+        self.executors = [
+            ProcessPoolExecutor(1, mp_context=mp.get_context('spawn'), initializer=_init_member_worker,
+                                initargs=(build_member, torch_threads))
+            for _ in range(n_workers)
+        ]
+        # data appended to the parent members outside of train (fine-tuning), not yet sent
+        self.pending = []
+        # whether the parent weights changed since the workers last trained (fine-tuning)
+        self.weights_changed = False
+
+    def record_finetune(self, theta, x):
+        """
+         Record that the parent members were fine-tuned on (theta, x): the data is sent with
+         the next training round, together with the fine-tuned weights
+        """
+        self.pending.append((theta, x))
+        self.weights_changed = True
+
+    def train(self, ensemble, theta, x, **train_kwargs):
+        """
+         Append (theta, x) to every member and train them in their workers
+         returns the members in the same order as ensemble, with the trained weights loaded
+        """
+        theta_sent = th.cat([theta_pending for theta_pending, _ in self.pending] + [theta]).share_memory_()
+        x_sent = th.cat([x_pending for _, x_pending in self.pending] + [x]).share_memory_()
+        # per-member seeds drawn from the parent so runs stay reproducible
+        seeds = th.randint(2**31 - 1, (len(ensemble),)).tolist()
+        futures = []
+        for idx, (inference, seed) in enumerate(zip(ensemble, seeds)):
+            state_dict = None
+            if self.weights_changed:
+                state_dict = {name: tensor.detach().cpu() for name, tensor in inference._neural_net.state_dict().items()}
+            futures.append(self.executors[idx % self.n_workers].submit(
+                _train_resident_member, idx, theta_sent, x_sent, state_dict, seed, train_kwargs))
+
+        for inference, future in zip(ensemble, futures):
+            state_dict = future.result()
+            inference.append_simulations(theta, x)
+            if inference._neural_net is None:
+                # built once on the member's device, as sbi's train() would, so fine-tuning stays there
+                theta_all, x_all, _ = inference.get_simulations()
+                inference._neural_net = inference._build_neural_net(theta_all.cpu(), x_all.cpu()).to(inference._device)
+            # weights arrive on the cpu and are copied onto the net's device
+            inference._neural_net.load_state_dict(state_dict)
+            inference._neural_net.eval()
+
+        self.pending = []
+        self.weights_changed = False
+        print(f' --- training complete ({len(ensemble)} members, {self.n_workers} workers) --- ')
+        return ensemble
+
+    def close(self) -> None:
+        for executor in self.executors:
+            executor.shutdown()
+        self.executors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def train_ensemble(ensemble, theta, x, n_workers=1, build_member=None, workers=None, **train_kwargs):
+    """
+     Append (theta, x) to every member of the ensemble and train them
+     with workers (an EnsembleWorkers kept for the whole run) the members are trained
+     concurrently in its processes. with n_workers > 1 and no workers, a temporary
+     EnsembleWorkers is started for this call, building the members with build_member
+     (a picklable callable returning a fresh inference object).
+     returns the trained members in the same order as ensemble
+    """
+    if workers is not None:
+        return workers.train(ensemble, theta, x, **train_kwargs)
+
+    if n_workers is None or n_workers <= 1:
+        for inference in ensemble:
+            _ = inference.append_simulations(theta, x).train(**train_kwargs)
+            print(' --- training complete --- ')
+        return ensemble
+
+    # members trained before live in the workers of their run, a temporary pool starts from scratch
+    assert all(inference._neural_net is None for inference in ensemble), 'pass the run\'s EnsembleWorkers to retrain members in parallel'
+    assert build_member is not None, 'build_member is required to train members in parallel'
+    with EnsembleWorkers(build_member, min(n_workers, len(ensemble))) as workers:
+        return workers.train(ensemble, theta, x, **train_kwargs)
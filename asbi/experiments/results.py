@@ -0,0 +1,121 @@
+import os
+import csv
+import json
+import sqlite3
+import pandas as pd
+from typing import Any, Dict, List
+
+# columns of a results row, one row per (repeat, n_sims, method) cell
+RESULTS_COLUMNS = ['repeat', 'n_sims', 'method', 'c2st_mean', 'c2st_std']
+
+# columns of the per-stage timings of each cell, with the peak memory of the cell repeated on every row
+TIMINGS_COLUMNS = ['repeat', 'n_sims', 'method', 'name', 'seconds', 'count', 'max_rss_mb', 'max_cuda_mb']
+
+# file extension of each results format
+RESULTS_EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'sqlite': 'db'}
+
+class ResultsWriter:
+    """
+     Append-only results sink: each row is written to disk as soon as its cell completes,
+     without rewriting earlier rows. rows are only turned into a dataframe by read()
+    """
+    def __init__(self, path: str, columns: List[str] = RESULTS_COLUMNS) -> None:
+        self.path = path
+        self.columns = columns
+
+    def append(self, row: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def read_rows(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def read(self) -> pd.DataFrame:
+        results_df = pd.DataFrame(self.read_rows(), columns=self.columns)
+        # missing stds (single observation) may come back as None
+        return results_df.astype({column: float for column in ['c2st_mean', 'c2st_std'] if column in self.columns})
+
+class CSVResultsWriter(ResultsWriter):
+    def append(self, row: Dict[str, Any]) -> None:
+        write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            if write_header:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def read_rows(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        return pd.read_csv(self.path).to_dict('records')
+
+class JSONLResultsWriter(ResultsWriter):
+    def append(self, row: Dict[str, Any]) -> None:
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(row) + '\n')
+
+    def read_rows(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+class SQLiteResultsWriter(ResultsWriter):
+    def __init__(self, path: str) -> None:
+        super().__init__(path, columns=RESULTS_COLUMNS)
+        with sqlite3.connect(self.path) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS results '
+                               '(repeat INTEGER, n_sims INTEGER, method TEXT, c2st_mean REAL, c2st_std REAL)')
+
+    def append(self, row: Dict[str, Any]) -> None:
+        with sqlite3.connect(self.path, timeout=60) as connection:
+            connection.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?)', [row[c] for c in RESULTS_COLUMNS])
+
+    def read_rows(self) -> List[Dict[str, Any]]:
+        with sqlite3.connect(self.path) as connection:
+            rows = connection.execute(f"SELECT {', '.join(RESULTS_COLUMNS)} FROM results ORDER BY rowid").fetchall()
+        return [dict(zip(RESULTS_COLUMNS, row)) for row in rows]
+
+def get_results_writer(path: str) -> ResultsWriter:
+    """
+     Get the results writer for a results file, chosen by its extension (.csv, .jsonl or .db)
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == '.csv':
+        return CSVResultsWriter(path)
+    elif extension == '.jsonl':
+        return JSONLResultsWriter(path)
+    elif extension == '.db':
+        return SQLiteResultsWriter(path)
+    else:
+        raise ValueError(f'unknown results format: {path}')
+
+def read_completed_rows(writer: ResultsWriter, cells: List[tuple]) -> List[Dict[str, Any]]:
+    """
+     Rows of the checkpoint of writer whose (repeat, n_sims, method) cell is in cells, with
+     typed values. reads through writer.read(), so missing stds (single observation, stored
+     as NULL by sqlite) come back as nan
+    """
+    cells = set(cells)
+    rows = []
+    for row in writer.read().to_dict('records'):
+        cell = (int(row['repeat']), int(row['n_sims']), row['method'])
+        if cell in cells:
+            rows.append({'repeat': cell[0], 'n_sims': cell[1], 'method': cell[2],
+                         'c2st_mean': float(row['c2st_mean']), 'c2st_std': float(row['c2st_std'])})
+    return rows
+
+def load_results(path: str) -> pd.DataFrame:
+    """
+     Load a results file (.csv, .jsonl or .db) into a dataframe
+    """
+    return get_results_writer(path).read()
+
+def append_timings(path: str, repeat: int, n_sims: int, method: str, timings: List[Dict[str, Any]],
+                   memory: Dict[str, Any]) -> None:
+    """
+     Append the stage timings and counters of one cell and its peak memory (see asbi.algorithms.timing)
+     to a csv file. only called from the process running the grid, writes are not safe across processes
+    """
+    writer = CSVResultsWriter(path, columns=TIMINGS_COLUMNS)
+    for timing in timings:
+        writer.append({'repeat': repeat, 'n_sims': n_sims, 'method': method, **timing, **memory})
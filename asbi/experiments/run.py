@@ -2,35 +2,92 @@ import os
 import sys
 import argparse
 import datetime
+import cProfile
 import pickle as pk
+from contextlib import contextmanager
+from functools import partial
 from pprint import pprint
-from typing import Any, Dict, List, LiteralString
+from typing import Any, Dict, List, LiteralString, Tuple
 
 import pandas as pd
 import torch as th
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from joblib import Parallel, delayed
 from tqdm import tqdm, trange
 
 from asbi.tasks import get_task
-from asbi.algorithms.nle import run_NLE, run_ensemble_NLE, run_bald_NLE
-from asbi.experiments.utils import load_config, get_device
+from asbi.tasks.simulator import CachedSimulator
+from asbi.algorithms.nle import run_NLE, run_ensemble_NLE, run_bald_NLE, simulate_initial_data
+from asbi.algorithms.timing import timer, reset_peak_memory, peak_memory
+from asbi.experiments.utils import load_config, get_device, get_reference_data, get_cell_seed, set_seed
 from sbibm.metrics import c2st
 from asbi.experiments.plot import plot_results
+from asbi.experiments.results import RESULTS_COLUMNS, RESULTS_EXTENSIONS, get_results_writer, read_completed_rows, append_timings
+
+# runner of a grid worker process, built once by _init_worker
+_worker_runner = None
+
+def _init_worker(config, output_path, output_dir, torch_threads):
+    """
+     Set up a grid worker: a runner writing to the parent's output directory
+    """
+    global _worker_runner
+    th.set_num_threads(torch_threads)
+    _worker_runner = Runner(config, output_path, output_dir=output_dir)
+
+def _run_cell_in_worker(repeat, n_sims, method, n_eval, bank):
+    return _worker_runner.run_cell(repeat, n_sims, method, n_eval, bank=bank)
+
+def build_simulator(config, output_path, cache_seed=0):
+    """
+     Build the simulator of the config's task, optionally memoizing simulations on disk
+     (shared across runs writing to output_path) under cache_seed
+     module-level so that async simulation workers can rebuild it (see run_bald_NLE)
+    """
+    # task constructor arguments, e.g. the ode backend and solver processes of sir and lotka_volterra
+    simulator = get_task(config['task'], **config.get('task_kwargs', {})).get_simulator()
+    cache_config = config.get('simulation_cache')
+    if cache_config:
+        cache_config = cache_config if isinstance(cache_config, dict) else {}
+        cache_path = cache_config.get('path', f"{output_path}/simulation_cache.db")
+        max_size_mb = cache_config.get('max_size_mb')
+        max_size_bytes = int(max_size_mb * 2**20) if max_size_mb is not None else None
+        simulator = CachedSimulator(simulator, cache_path, max_size_bytes=max_size_bytes, seed=cache_seed)
+    return simulator
 
 class Runner: 
-    def __init__(self, config, output_path) -> None:
+    def __init__(self, config, output_path, output_dir=None) -> None:
         self.config = config
         # get task, simulator, and prior
-        self.task = get_task(self.config['task'])
-        self.simulator = self.task.get_simulator()
+        self.task = get_task(self.config['task'], **self.config.get('task_kwargs', {}))
+        self.simulator = build_simulator(self.config, output_path)
         self.prior = self.task.get_prior_dist()
         
         # set device for computation
         self.device = get_device()
+
+        # number of processes used to train ensemble members in parallel
+        self.n_train_workers = self.config.get('n_train_workers', 1)
+        # number of processes used to compute c2st over the evaluation observations
+        self.n_eval_workers = self.config.get('n_eval_workers', 1)
+        # simulate one nested bank per repeat that all methods and n_sims take prefixes of
+        self.shared_bank = self.config.get('shared_bank', False)
+        # number of processes running cells of the experiment grid in parallel
+        self.n_workers = self.config.get('n_workers', 1)
+        # base seed from which every grid cell derives its own seed
+        self.seed = self.config.get('seed', 0)
+        # format of the streamed results checkpoint: csv, jsonl or sqlite
+        self.results_format = self.config.get('results_format', 'csv')
+        # optional per-cell profile dump: 'cprofile' or 'torch'
+        self.profile = self.config.get('profile', None)
         
-        # set up directories for outputs
-        self.output_dir = f"{output_path}/{datetime.datetime.now()}"
+        # set up directories for outputs (an existing output_dir is reused)
+        self.output_path = output_path
+        self.output_dir = output_dir if output_dir is not None else f"{output_path}/{datetime.datetime.now()}"
         self.results_dir = f"{self.output_dir}/results"
         self.plots_dir = f"{self.output_dir}/plots"
+        self.profiles_dir = f"{self.output_dir}/profiles"
         
         # create directories if they do not exist
         if not os.path.exists(self.results_dir):
@@ -95,56 +152,151 @@ class Runner:
             print('Saving results as pickle...')
             pk.dump(results_df, f)
 
-        # plot results
-        print("Plotting results...")
-        plot_results(results_df, self.plots_dir)
+        # plot results (or later on demand with scripts/python/plot_results.py)
+        if self.config.get('plot', True):
+            print("Plotting results...")
+            plot_results(results_df, self.plots_dir)
     
         return 
     
     def run_multiple_experiments(self, n_sims_array: List , methods_array: List, n_repeats: int, n_eval: int) -> pd.DataFrame:
         """
         Run multiple experiments and save results to a dataframe
+
+        The grid of repeats x n_sims x methods is expanded into independent cells,
+        run serially or, with n_workers > 1 in the config, in a pool of worker
+        processes. Every completed cell is appended to the checkpoint, and cells
+        already in the checkpoint of the output directory are skipped (resume).
+        The dataframe is only assembled at the end.
         
         Returns:
             pd.DataFrame: Results with columns [repeat, n_sims, method, c2st_mean, c2st_std]
         """
         print('Running multiple experiments...')
         
-        # Create empty dataframe
-        results_df = pd.DataFrame(columns=['repeat', 'n_sims', 'method', 'c2st_mean', 'c2st_std'])
-        
-        # Create checkpoint file
-        checkpoint_file = f"{self.results_dir}/results_checkpoint.csv"
-        
-        for i in trange(n_repeats):
-            print(f"\n=== Repeat: {i+1}/{n_repeats} ===")
-            for j, n_sims in enumerate(tqdm(n_sims_array, desc="Sim sizes")):
-                for k, method in enumerate(methods_array):
-                    print(f"Running {method} with {n_sims} simulations")
-                    c2st_mean, c2st_std = self.run_one_experiment(n_sims, method, n_eval)
-                    
-                    # Append row to dataframe
-                    new_row = pd.DataFrame({
-                        'repeat': [i+1],
-                        'n_sims': [n_sims],
-                        'method': [method],
-                        'c2st_mean': [c2st_mean.item()],
-                        'c2st_std': [c2st_std.item()]
-                    })
-                    results_df = pd.concat([results_df, new_row], ignore_index=True)
-                    
-                    # Save checkpoint after each method
-                    results_df.to_csv(checkpoint_file, index=False)
-                    
-                # Plot intermediate results after each n_sims value
-                if j > 0:  # Only plot if we have data for at least two n_sims values
-                    plot_results(results_df, self.plots_dir, intermediate=True)
-
-        return results_df    
-
-    def run_one_experiment(self, n_sims: int, method: LiteralString, n_eval: int):
+        # Create checkpoint file, rows are appended as cells complete
+        checkpoint_file = f"{self.results_dir}/results_checkpoint.{RESULTS_EXTENSIONS[self.results_format]}"
+        writer = get_results_writer(checkpoint_file)
+
+        # expand the grid into cells
+        cells = [(i + 1, n_sims, method) for i in range(n_repeats) for n_sims in n_sims_array for method in methods_array]
+
+        # when resuming into an existing output directory, cells in the checkpoint are not run again
+        # (every cell is seeded from its coordinates, so remaining cells run as they would have)
+        rows = read_completed_rows(writer, cells)
+        if rows:
+            print(f'Resuming from {checkpoint_file}: {len(rows)}/{len(cells)} cells completed')
+        completed = {(row['repeat'], row['n_sims'], row['method']) for row in rows}
+        remaining = [cell for cell in cells if cell not in completed]
+
+        # shared banks are simulated once per repeat up front and handed to the cells
+        banks = {}
+        if self.shared_bank:
+            for i in sorted({repeat for repeat, _, _ in remaining}):
+                print(f"Simulating shared bank of {max(n_sims_array)} simulations for repeat {i}")
+                banks[i] = self.simulate_bank(i, max(n_sims_array))
+
+        def add_row(row, timings, memory):
+            rows.append(row)
+            # Save checkpoint after each cell
+            writer.append(row)
+            # timings of worker cells are written here too, only this process appends to the csv
+            append_timings(f"{self.results_dir}/timings.csv", row['repeat'], row['n_sims'], row['method'], timings, memory)
+
+        if self.n_workers <= 1:
+            for i in trange(n_repeats):
+                print(f"\n=== Repeat: {i+1}/{n_repeats} ===")
+                for n_sims in tqdm(n_sims_array, desc="Sim sizes"):
+                    for method in methods_array:
+                        if (i + 1, n_sims, method) in completed:
+                            continue
+                        add_row(*self.run_cell(i + 1, n_sims, method, n_eval, bank=banks.get(i + 1)))
+        else:
+            torch_threads = max(1, (os.cpu_count() or 1) // self.n_workers)
+            with ProcessPoolExecutor(self.n_workers, mp_context=get_context('spawn'), initializer=_init_worker,
+                                     initargs=(self.config, self.output_path, self.output_dir, torch_threads)) as executor:
+                futures = [executor.submit(_run_cell_in_worker, *cell, n_eval, banks.get(cell[0])) for cell in remaining]
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Grid cells"):
+                    add_row(*future.result())
+
+        # assemble the results in grid order
+        order = {cell: idx for idx, cell in enumerate(cells)}
+        rows.sort(key=lambda row: order[(row['repeat'], row['n_sims'], row['method'])])
+        return pd.DataFrame(rows, columns=RESULTS_COLUMNS)
+
+    def simulate_bank(self, repeat: int, n_sims: int):
+        """
+         Simulate the shared nested bank of a repeat, seeded per repeat
+        """
+        if isinstance(self.simulator, CachedSimulator):
+            self.simulator.seed = repeat - 1
+        set_seed(get_cell_seed(self.seed, repeat, 'bank'))
+        return simulate_initial_data(self.simulator, self.prior, n_sims)
+
+    def run_cell(self, repeat: int, n_sims: int, method: LiteralString, n_eval: int, bank=None) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]:
+        """
+         Run one cell (repeat, n_sims, method) of the experiment grid with its own seed
+         returns the results row, the per-stage timings and the peak memory of the cell
+        """
+        print(f"Running {method} with {n_sims} simulations (repeat {repeat})")
+        if isinstance(self.simulator, CachedSimulator):
+            # simulations are shared within a repeat, independent across repeats
+            self.simulator.seed = repeat - 1
+        set_seed(get_cell_seed(self.seed, repeat, n_sims, method))
+
+        # per-stage timings and peak memory of the cell are written next to the results
+        timer.reset()
+        reset_peak_memory()
+        try:
+            with self.profiled(f"repeat{repeat}_nsims{n_sims}_{method}"), timer.stage('cell'):
+                c2st_mean, c2st_std = self.run_one_experiment(n_sims, method, n_eval, bank=bank)
+        finally:
+            # shut down task worker pools (e.g. ODE solvers), restarted lazily by the next cell
+            self.task.close()
+
+        row = {
+            'repeat': repeat,
+            'n_sims': n_sims,
+            'method': method,
+            'c2st_mean': c2st_mean.item(),
+            'c2st_std': c2st_std.item(),
+        }
+        return row, timer.summary(), peak_memory()
+
+    @contextmanager
+    def profiled(self, name: str):
+        """
+         Profile the enclosed code with cProfile or the torch profiler (config 'profile')
+         and dump the profile to profiles/<name>.prof (cprofile) or <name>.json (torch trace)
+        """
+        if self.profile is None:
+            yield
+            return
+
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        if self.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(f"{self.profiles_dir}/{name}.prof")
+        elif self.profile == 'torch':
+            activities = [th.profiler.ProfilerActivity.CPU]
+            if th.cuda.is_available():
+                activities.append(th.profiler.ProfilerActivity.CUDA)
+            with th.profiler.profile(activities=activities) as profiler:
+                yield
+            profiler.export_chrome_trace(f"{self.profiles_dir}/{name}.json")
+        else:
+            print(f"profiler: {self.profile} not found")
+            sys.exit(1)
+
+    def run_one_experiment(self, n_sims: int, method: LiteralString, n_eval: int, bank=None):
         """
          run 1 experiment with 1 method. Eval on 10 true obs
+         prior simulations are taken as prefixes of bank = (theta, x) if given
          returns c2st 
         """
         if n_eval > 10:
@@ -152,7 +304,8 @@ class Runner:
             n_eval = 10
 
         if method == 'NLE':
-            posterior = run_NLE(self.simulator, self.prior, n_sims, device=self.device)
+            initial_data = (bank[0][:n_sims], bank[1][:n_sims]) if bank is not None else None
+            posterior = run_NLE(self.simulator, self.prior, n_sims, device=self.device, initial_data=initial_data)
 
         elif method == 'EnsembleNLE':
             try:
@@ -162,7 +315,8 @@ class Runner:
                 print('n_ensemble_members not found in config. Using default value of 3')
                 n_ensemble_members = 3
                 
-            posterior = run_ensemble_NLE(self.simulator, self.prior, n_sims, n_ensemble_members=n_ensemble_members, device=self.device)
+            initial_data = (bank[0][:n_sims], bank[1][:n_sims]) if bank is not None else None
+            posterior = run_ensemble_NLE(self.simulator, self.prior, n_sims, n_ensemble_members=n_ensemble_members, device=self.device, n_workers=self.n_train_workers, initial_data=initial_data)
 
         elif method == 'BALD_NLE':
             try:
@@ -176,23 +330,61 @@ class Runner:
                 print('missing parameters for BALD_NLE in config')
                 sys.exit(1)
 
+            # number of pool thetas scored per batched pass (bounds memory)
+            chunk_size = self.config.get('acq_chunk_size', 256)
+            # number of thetas acquired per round (greedy BatchBALD if > 1)
+            acquisition_batch_size = self.config.get('acquisition_batch_size', 1)
+
+            # evaluate the ensemble with stacked weights when scoring the pool
+            stacked_ensemble = self.config.get('stacked_ensemble', False)
+
+            # optional warm-start fine-tuning between acquisitions
+            warm_start_kwargs = {
+                'warm_start': self.config.get('warm_start', False),
+                'n_finetune_steps': self.config.get('n_finetune_steps', 100),
+                'finetune_batch_size': self.config.get('finetune_batch_size', 200),
+                'full_retrain_every': self.config.get('full_retrain_every', None),
+            }
+
+            # initial set from the shared bank, active simulations are always new
+            initial_data = (bank[0][:n_sims_init], bank[1][:n_sims_init]) if bank is not None else None
+
+            # optional asynchronous simulation of acquired thetas, overlapping with training
+            async_kwargs = {
+                'async_simulation': self.config.get('async_simulation', False),
+                'n_sim_workers': self.config.get('n_sim_workers', 1),
+                'max_staleness': self.config.get('max_staleness', 1),
+            }
+
+            # async simulation workers rebuild the simulator, with the cache seed of this cell
+            cache_seed = self.simulator.seed if isinstance(self.simulator, CachedSimulator) else 0
+            async_kwargs['build_simulator'] = partial(build_simulator, self.config, self.output_path, cache_seed)
+
             print("running BALD NLE...")
             print(f"n_sims_init: {n_sims_init}, n_sims_active: {n_sims_active}")
-            posterior = run_bald_NLE(self.simulator, self.prior, n_sims_init, n_sims_active, theta_pool_size, n_ensemble_members, device=self.device)
+            posterior = run_bald_NLE(self.simulator, self.prior, n_sims_init, n_sims_active, theta_pool_size, n_ensemble_members, device=self.device, chunk_size=chunk_size, acquisition_batch_size=acquisition_batch_size, n_workers=self.n_train_workers, stacked_ensemble=stacked_ensemble, initial_data=initial_data, **warm_start_kwargs, **async_kwargs)
 
         else:
             print(f'method: {method} not found')
             sys.exit(1)
 
         print('running evaluation...')
-        c2st_accuracy = th.empty(n_eval)
 
-        # get c2st for all observation in evaluation set
+        # sample the posterior for all observations in evaluation set
+        # (reference sets are cached in memory after the first load)
+        eval_samples = []
         for i in range(1, n_eval + 1):
-            reference_samples = self.task.get_reference_posterior_samples(num_observation=i)
-            obs = self.task.get_observation(num_observation=i)
-            posterior_samples = posterior.sample((len(reference_samples),), x=obs)
-            c2st_accuracy[i-1] = c2st(reference_samples, posterior_samples)
+            reference_samples, obs = get_reference_data(self.config['task'], i)
+            with timer.stage('posterior_sampling'):
+                posterior_samples = posterior.sample((len(reference_samples),), x=obs)
+            eval_samples.append((reference_samples, posterior_samples))
+
+        # get c2st for all observations in parallel workers
+        with timer.stage('c2st'):
+            c2st_accuracy = Parallel(n_jobs=self.n_eval_workers)(
+                delayed(c2st)(reference_samples, posterior_samples) for reference_samples, posterior_samples in eval_samples
+            )
+        c2st_accuracy = th.cat([accuracy.reshape(-1) for accuracy in c2st_accuracy])
 
         # return to mean and std of the c2st across all obs
         return c2st_accuracy.mean(), c2st_accuracy.std()
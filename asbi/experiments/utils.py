@@ -1,7 +1,12 @@
 import sys
 import yaml
+import hashlib
+import numpy as np
 import torch as th
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Tuple
+
+from asbi.tasks import get_task
 
 def load_config(config_path: str) -> Dict[str, Any]:
     """
@@ -29,3 +34,29 @@ def get_device():
         device = th.device("cpu")
         print("No GPU available, using CPU")
     return device
+
+@lru_cache(maxsize=None)
+def get_reference_data(task_name: str, num_observation: int) -> Tuple[th.Tensor, th.Tensor]:
+    """
+     Load the reference posterior samples and the observation of a task
+     cached in memory, so each reference set is read from disk once per process
+    """
+    task = get_task(task_name)
+    reference_samples = task.get_reference_posterior_samples(num_observation=num_observation)
+    obs = task.get_observation(num_observation=num_observation)
+    return reference_samples, obs
+
+def get_cell_seed(seed: int, *cell: Any) -> int:
+    """
+     Derive a seed for one cell of the experiment grid (e.g. repeat, n_sims, method)
+     from the base seed, independent of the order or process in which cells run
+    """
+    key = '/'.join(str(c) for c in (seed, *cell))
+    return int(hashlib.sha256(key.encode()).hexdigest()[:8], 16)
+
+def set_seed(seed: int) -> None:
+    """
+     Seed the torch and numpy random number generators
+    """
+    th.manual_seed(seed)
+    np.random.seed(seed)
@@ -1,65 +1,92 @@
 from pathlib import Path
-from typing import Any, List
+from typing import Any, Dict, List
 
-from sbibm.tasks.task import Task
+from asbi.tasks import task as _task_module
+from asbi.tasks.task import Task
+
+# task instances built in this process, keyed by name and constructor arguments
+_task_registry: Dict[tuple, Task] = {}
 
 
 def get_task(task_name: str, *args: Any, **kwargs: Any) -> Task:
     """Get task
 
+    Task instances are memoized per process: repeated calls with the same name and
+    arguments return the same instance. Arguments that cannot be hashed bypass the
+    registry. Use `clear_cache` to drop memoized tasks and static assets.
+
     Args:
         task_name: Name of task
 
     Returns:
         Task instance
     """
+    key = (task_name, args, tuple(sorted(kwargs.items())))
+    try:
+        task = _task_registry.get(key)
+    except TypeError:
+        return _build_task(task_name, *args, **kwargs)
+    if task is None:
+        task = _task_registry[key] = _build_task(task_name, *args, **kwargs)
+    return task
+
+
+def clear_cache():
+    """Clear memoized task instances, static task assets and validated binary caches"""
+    _task_registry.clear()
+    _task_module._static_assets.clear()
+    _task_module._validated_caches.clear()
+
+
+def _build_task(task_name: str, *args: Any, **kwargs: Any) -> Task:
+    """Build a new task instance"""
     if task_name == "lotka_volterra":
-        from sbibm.tasks.lotka_volterra.task import LotkaVolterra
+        from asbi.tasks.lotka_volterra.task import LotkaVolterra
 
         return LotkaVolterra(*args, **kwargs)
 
     elif task_name == "bernoulli_glm":
-        from sbibm.tasks.bernoulli_glm.task import BernoulliGLM
+        from asbi.tasks.bernoulli_glm.task import BernoulliGLM
 
         return BernoulliGLM(*args, **kwargs)
 
     elif task_name == "bernoulli_glm_raw":
-        from sbibm.tasks.bernoulli_glm.task import BernoulliGLM
+        from asbi.tasks.bernoulli_glm.task import BernoulliGLM
 
         return BernoulliGLM(*args, summary="raw", **kwargs)
 
     elif task_name == "gaussian_linear":
-        from sbibm.tasks.gaussian_linear.task import GaussianLinear
+        from asbi.tasks.gaussian_linear.task import GaussianLinear
 
         return GaussianLinear(*args, **kwargs)
 
     elif task_name == "gaussian_linear_uniform":
-        from sbibm.tasks.gaussian_linear_uniform.task import GaussianLinearUniform
+        from asbi.tasks.gaussian_linear_uniform.task import GaussianLinearUniform
 
         return GaussianLinearUniform(*args, **kwargs)
 
     elif task_name == "gaussian_mixture":
-        from sbibm.tasks.gaussian_mixture.task import GaussianMixture
+        from asbi.tasks.gaussian_mixture.task import GaussianMixture
 
         return GaussianMixture(*args, **kwargs)
 
     elif task_name == "slcp" or task_name == "gaussian_nonlinear":
-        from sbibm.tasks.slcp.task import SLCP
+        from asbi.tasks.slcp.task import SLCP
 
         return SLCP(*args, **kwargs)
 
     elif task_name == "slcp_distractors":
-        from sbibm.tasks.slcp.task import SLCP
+        from asbi.tasks.slcp.task import SLCP
 
         return SLCP(*args, distractors=True, **kwargs)
 
     if task_name == "sir":
-        from sbibm.tasks.sir.task import SIR
+        from asbi.tasks.sir.task import SIR
 
         return SIR(*args, **kwargs)
 
     elif task_name == "two_moons":
-        from sbibm.tasks.two_moons.task import TwoMoons
+        from asbi.tasks.two_moons.task import TwoMoons
 
         return TwoMoons(*args, **kwargs)
 
@@ -1,13 +1,14 @@
 from pathlib import Path
-from typing import Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import numpy as np
 import pyro
 import pyro.distributions as pdist
 import torch
+import torch.multiprocessing as mp
 
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task, get_tensor_from_binary_cache, load_static_asset
 from sbibm.utils.io import get_tensor_from_csv
 from sbibm.utils.torch import get_default_device
 
@@ -59,6 +60,16 @@ class BernoulliGLM(Task):
         self.prior_dist = pdist.MultivariateNormal(**self.prior_params)
         self.prior_dist.set_default_validate_args(False)
 
+    @property
+    def stimulus_I(self) -> torch.Tensor:
+        """Input stimulus, loaded once per process"""
+        return load_static_asset(self.path / "files" / "stimulus_I.pt")
+
+    @property
+    def design_matrix(self) -> torch.Tensor:
+        """Design matrix of the GLM, loaded once per process"""
+        return load_static_asset(self.path / "files" / "design_matrix.pt")
+
     def get_prior(self) -> Callable:
         def prior(num_samples=1):
             return pyro.sample("parameters", self.prior_dist.expand_by([num_samples]))
@@ -78,8 +89,8 @@ class BernoulliGLM(Task):
         """
         device = get_default_device()
 
-        stimulus_I = torch.load(self.path / "files" / "stimulus_I.pt").to(device)
-        design_matrix = torch.load(self.path / "files" / "design_matrix.pt").to(device)
+        stimulus_I = self.stimulus_I.to(device)
+        design_matrix = self.design_matrix.to(device)
 
         def simulator(
             parameters: torch.Tensor, return_both: bool = False
@@ -89,31 +100,31 @@ class BernoulliGLM(Task):
             If `return_both` is True, will additionally return spike train not reduced to summary features
             """
 
-            data = []
-            data_raw = []
-            for b in range(parameters.shape[0]):
-                # Simulate GLM
-                psi = torch.matmul(design_matrix, parameters[b, :])
-                z = 1 / (1 + torch.exp(-psi))
-                y = (torch.rand(design_matrix.shape[0]) < z).float()
+            num_parameters = parameters.shape[0]
 
-                # Calculate summary statistics
-                num_spikes = torch.sum(y).unsqueeze(0)
-                sta = torch.nn.functional.conv1d(
-                    y.reshape(1, 1, -1), stimulus_I.reshape(1, 1, -1), padding=8
-                ).squeeze()[-9:]
-                data.append(torch.cat((num_spikes, sta)))
+            # Simulate GLM for all parameters at once, row b of the uniform draws
+            # consumes the same random numbers as the b-th draw of a per-sample loop
+            psi = torch.matmul(design_matrix, parameters.T).T
+            z = 1 / (1 + torch.exp(-psi))
+            y = (torch.rand(num_parameters, design_matrix.shape[0]) < z).float()
 
-                if self.raw or return_both:
-                    data_raw.append(y)
+            # Calculate summary statistics, one conv1d over the batch
+            # (mkldnn reorders the sums for batched inputs, the native kernel
+            # matches the per-sample summaries exactly)
+            num_spikes = torch.sum(y, dim=1, keepdim=True)
+            with torch.backends.mkldnn.flags(enabled=False):
+                sta = torch.nn.functional.conv1d(
+                    y.unsqueeze(1), stimulus_I.reshape(1, 1, -1), padding=8
+                ).squeeze(1)[:, -9:]
+            data = torch.cat((num_spikes, sta), dim=1)
 
             if not return_both:
                 if not self.raw:
-                    return torch.stack(data)
+                    return data
                 else:
-                    return torch.stack(data_raw)
+                    return y
             else:
-                return torch.stack(data), torch.stack(data_raw)
+                return data, y
 
         return Simulator(task=self, simulator=simulator, max_calls=max_calls)
 
@@ -126,7 +137,7 @@ class BernoulliGLM(Task):
                 / f"num_observation_{num_observation}"
                 / "observation.csv"
             )
-            return get_tensor_from_csv(path)
+            return get_tensor_from_binary_cache(path)
         else:
             path = (
                 self.path
@@ -134,7 +145,7 @@ class BernoulliGLM(Task):
                 / f"num_observation_{num_observation}"
                 / "observation_raw.csv"
             )
-            return get_tensor_from_csv(path)
+            return get_tensor_from_binary_cache(path)
 
     def flatten_data(self, data: torch.Tensor) -> torch.Tensor:
         """Flattens data
@@ -150,45 +161,76 @@ class BernoulliGLM(Task):
         self,
         num_samples: int,
         num_observation: Optional[int] = None,
+        num_chains: int = 4,
     ) -> torch.Tensor:
-        from pypolyagamma import PyPolyaGamma
-        from tqdm import tqdm
+        """Sample reference posterior with Polya-Gamma Gibbs sampling
+
+        Runs `num_chains` independent chains in parallel processes, each
+        initialized at the true parameters, and concatenates their thinned
+        samples.
 
-        self.dim_data = 10
-        # stimulus_I = torch.load(self.path / "files" / "stimulus_I.pt")
-        design_matrix = torch.load(self.path / "files" / "design_matrix.pt")
+        Args:
+            num_samples: Number of samples to generate
+            num_observation: Observation number
+            num_chains: Number of chains, each run in its own process
+
+        Returns:
+            Samples from reference posterior
+        """
+        # stimulus_I = self.stimulus_I
+        design_matrix = self.design_matrix
         true_parameters = self.get_true_parameters(num_observation)
-        self.raw = True
-        observation_raw = self.get_observation(num_observation)
-        self.raw = False
+        # read the raw spike train directly, so that shared task instances are not modified
+        observation_raw = get_tensor_from_binary_cache(
+            self.path
+            / "files"
+            / f"num_observation_{num_observation}"
+            / "observation_raw.csv"
+        )
 
         mcmc_num_samples_warmup = 25000
         mcmc_thinning = 25
-        mcmc_num_samples = mcmc_num_samples_warmup + mcmc_thinning * num_samples
-
-        pg = PyPolyaGamma()
-        X = design_matrix.numpy()
-        obs = observation_raw.numpy()
-        Binv = self.prior_params["precision_matrix"].numpy()
-
-        sample = true_parameters.numpy().reshape(-1)  # Init at true parameters
-        samples = []
-        for j in tqdm(range(mcmc_num_samples)):
-            psi = np.dot(X, sample)
-            w = np.array([pg.pgdraw(1, b) for b in psi])
-            O = np.diag(w)  # noqa: E741
-            V = np.linalg.inv(np.dot(np.dot(X.T, O), X) + Binv)
-            m = np.dot(V, np.dot(X.T, obs.reshape(-1) - 1 * 0.5))
-            sample = np.random.multivariate_normal(np.ravel(m), V)
-            samples.append(sample)
-        samples = np.asarray(samples).astype(np.float32)
-        samples_subset = samples[mcmc_num_samples_warmup::mcmc_thinning, :]
-
-        reference_posterior_samples = torch.from_numpy(samples_subset)
+        num_samples_per_chain = -(-num_samples // num_chains)
+
+        X = design_matrix.numpy().astype(np.float64)
+        obs = observation_raw.numpy().reshape(-1).astype(np.float64)
+        Binv = self.prior_params["precision_matrix"].numpy().astype(np.float64)
+        init = true_parameters.numpy().reshape(-1).astype(np.float64)
+
+        # Seeds of the chains follow from the global numpy seed (see `_setup`)
+        seeds = np.random.randint(2**31 - 1, size=num_chains)
+        chain_args = [
+            (
+                X,
+                obs,
+                Binv,
+                init,
+                mcmc_num_samples_warmup,
+                num_samples_per_chain,
+                mcmc_thinning,
+                int(seed),
+                chain == 0,
+            )
+            for chain, seed in enumerate(seeds)
+        ]
+        if num_chains == 1:
+            chains = [_run_polya_gamma_chain(*chain_args[0])]
+        else:
+            with mp.get_context("spawn").Pool(num_chains) as pool:
+                chains = pool.starmap(_run_polya_gamma_chain, chain_args)
+
+        samples = np.concatenate(chains)[:num_samples].astype(np.float32)
+        reference_posterior_samples = torch.from_numpy(samples)
 
         return reference_posterior_samples
 
-    def _setup(self, regenerate_stimulus=False):
+    def _setup(
+        self,
+        n_jobs: int = -1,
+        create_reference: bool = True,
+        regenerate_stimulus: bool = False,
+        **kwargs: Any,
+    ):
         """Setup the task: generate observations and reference posterior samples
 
         In most cases, you don't need to execute this method, since its results are stored to disk.
@@ -197,6 +239,7 @@ class BernoulliGLM(Task):
         Reference samples are constructed using Polya-Gamma MCMC. The sampler consists of two iterative Gibbs updates:
         1. sample auxiliary variables: w ~ PG(N, psi)
         2. sample parameters: beta ~ N(m, V); V = inv(X'O X + Binv), m = V*(X'k), k = y - N/2
+        The precision X'O X + Binv is formed without a dense O and factorized by Cholesky.
 
         Note that running this method requires pypolyagamma, see https://github.com/slinderman/pypolyagamma
         for installation instructions.
@@ -210,7 +253,13 @@ class BernoulliGLM(Task):
         cd pypolyagamma
         pip install -e .
 
-        Takes about 1-2 minutes on a laptop per observation
+        Observations are generated in parallel by `Task._setup`, and independent chains
+        run in parallel processes, see `_sample_reference_posterior`
+
+        Args:
+            n_jobs: Number of to use for Joblib
+            create_reference: If False, skips reference creation
+            regenerate_stimulus: If True, regenerates stimulus and design matrix
         """
         # Generate input stimulus (same across all observations)
         # Stimulus is Gaussian white noise ~N(0, 1)
@@ -243,38 +292,142 @@ class BernoulliGLM(Task):
             path.parent.mkdir(parents=True, exist_ok=True)
             torch.save(design_matrix, path)
 
-        observation_seeds = np.arange(self.num_observations, dtype=np.int) + int(1e6)
-        for num_observation, observation_seed in enumerate(observation_seeds, start=1):
-            np.random.seed(observation_seed)
-            torch.manual_seed(observation_seed)
-            self._save_observation_seed(num_observation, observation_seed)
+        super()._setup(n_jobs=n_jobs, create_reference=create_reference, **kwargs)
 
-            prior = self.get_prior()
-            true_parameters = prior(num_samples=1)
-            self._save_true_parameters(num_observation, true_parameters)
+    def _setup_observation(
+        self,
+        num_observation: int,
+        observation_seed: int,
+        create_reference: bool = True,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """Generate and save observation and reference posterior samples for one
+        observation number, including the raw observed spike train
+
+        Both variants share their files, which are always generated from the task
+        with sufficient summary statistics.
+
+        See `Task._setup_observation`
+        """
+        if self.raw:
+            return BernoulliGLM()._setup_observation(
+                num_observation,
+                observation_seed,
+                create_reference=create_reference,
+                **kwargs,
+            )
 
-            simulator = self.get_simulator()
-            observation, observation_raw = simulator(true_parameters, return_both=True)
-            self._save_observation(num_observation, observation)
+        np.random.seed(observation_seed)
+        torch.manual_seed(observation_seed)
+        self._save_observation_seed(num_observation, observation_seed)
 
-            path = (
-                self.path
-                / "files"
-                / f"num_observation_{num_observation}"
-                / "observation_raw.csv"
-            )
-            self.dim_data = 100
-            self.save_data(path, observation_raw)
-            self.dim_data = 10
+        prior = self.get_prior()
+        true_parameters = prior(num_samples=1)
+        self._save_true_parameters(num_observation, true_parameters)
+
+        simulator = self.get_simulator()
+        observation, observation_raw = simulator(true_parameters, return_both=True)
+        self._save_observation(num_observation, observation)
+
+        path = (
+            self.path
+            / "files"
+            / f"num_observation_{num_observation}"
+            / "observation_raw.csv"
+        )
+        dim_data = self.dim_data
+        self.dim_data = 100
+        self.save_data(path, observation_raw)
+        self.dim_data = dim_data
 
+        if create_reference:
             reference_posterior_samples = self._sample_reference_posterior(
-                num_samples=10_000, num_observation=num_observation
+                num_samples=self.num_reference_posterior_samples,
+                num_observation=num_observation,
+                **kwargs,
             )
 
             self._save_reference_posterior_samples(
                 num_observation, reference_posterior_samples
             )
 
+        return {"acceptance_rate": None}
+
+    def _verify_observation(self, num_observation: int) -> bool:
+        """Check that the files of an observation number, including the raw
+        observed spike train, exist and are complete"""
+        if self.raw:
+            return BernoulliGLM()._verify_observation(num_observation)
+
+        path = (
+            self.path
+            / "files"
+            / f"num_observation_{num_observation}"
+            / "observation_raw.csv"
+        )
+        try:
+            observation_raw = get_tensor_from_csv(path)
+        except (OSError, ValueError, KeyError, EOFError):
+            return False
+        return observation_raw.shape == (1, 100) and super()._verify_observation(
+            num_observation
+        )
+
+
+def _run_polya_gamma_chain(
+    X: np.ndarray,
+    obs: np.ndarray,
+    Binv: np.ndarray,
+    init: np.ndarray,
+    num_warmup: int,
+    num_samples: int,
+    thinning: int,
+    seed: int,
+    progress: bool = False,
+) -> np.ndarray:
+    """Run one Polya-Gamma Gibbs chain of the Bernoulli GLM posterior
+
+    Args:
+        X: Design matrix, `num_bins` x `dim_parameters`
+        obs: Raw observed spike train, `num_bins`
+        Binv: Prior precision matrix
+        init: Initial parameters
+        num_warmup: Number of warmup iterations
+        num_samples: Number of samples to return after thinning
+        thinning: Thinning factor
+        seed: Seed of the chain
+        progress: Whether to show a progress bar
+
+    Returns:
+        Samples, `num_samples` x `dim_parameters`
+    """
+    from pypolyagamma import PyPolyaGamma
+    from scipy.linalg import cho_solve, solve_triangular
+    from tqdm import tqdm
+
+    rng = np.random.default_rng(seed)
+    pg = PyPolyaGamma(seed=seed)
+
+    ones = np.ones(X.shape[0])
+    w = np.empty(X.shape[0])
+    Xk = np.dot(X.T, obs - 1 * 0.5)
+
+    sample = init.copy()
+    samples = np.empty((num_samples, X.shape[1]))
+    for j in tqdm(range(num_warmup + thinning * num_samples), disable=not progress):
+        psi = np.dot(X, sample)
+        pg.pgdrawv(ones, psi, w)
+        # Precision X'O X + Binv, scaling rows of X instead of building diag(w)
+        L = np.linalg.cholesky(np.dot(X.T, w[:, None] * X) + Binv)
+        m = cho_solve((L, True), Xk)
+        # beta = m + L'^-1 z has covariance (L L')^-1
+        sample = m + solve_triangular(
+            L.T, rng.standard_normal(X.shape[1]), lower=False
+        )
+        if j >= num_warmup and (j - num_warmup) % thinning == 0:
+            samples[(j - num_warmup) // thinning] = sample
+    return samples
+
 
 if __name__ == "__main__":
     task = BernoulliGLM()
@@ -5,8 +5,8 @@ import pyro
 import torch
 from pyro import distributions as pdist
 
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task
 
 
 class GaussianLinear(Task):
@@ -7,8 +7,9 @@ import pyro
 import torch
 from pyro import distributions as pdist
 
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.rejection import sample_rejection_batched
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task
 
 
 class GaussianLinearUniform(Task):
@@ -106,27 +107,22 @@ class GaussianLinearUniform(Task):
 
         log = logging.getLogger(__name__)
 
-        reference_posterior_samples = []
-
         sampling_dist = pdist.MultivariateNormal(
-            loc=observation,
+            loc=observation.reshape(-1),
             precision_matrix=self.simulator_params["precision_matrix"],
         )
 
-        # Reject samples outside of prior bounds
-        counter = 0
-        while len(reference_posterior_samples) < num_samples:
-            counter += 1
-            sample = sampling_dist.sample()
-            if not torch.isinf(self.prior_dist.log_prob(sample).sum()):
-                reference_posterior_samples.append(sample)
-
-        reference_posterior_samples = torch.cat(reference_posterior_samples)
-        acceptance_rate = float(num_samples / counter)
+        # Reject samples outside of prior bounds and duplicates
+        reference_posterior_samples, acceptance_rate = sample_rejection_batched(
+            lambda num_proposals: sampling_dist.sample((num_proposals,)),
+            self.prior_dist,
+            num_samples,
+        )
 
         log.info(
             f"Acceptance rate for observation {num_observation}: {acceptance_rate}"
         )
+        self.reference_acceptance_rate = acceptance_rate
 
         return reference_posterior_samples
 
@@ -6,8 +6,9 @@ import pyro
 import torch
 from pyro import distributions as pdist
 
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.rejection import sample_rejection_batched
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task
 
 
 class GaussianMixture(Task):
@@ -114,39 +115,26 @@ class GaussianMixture(Task):
 
         log = logging.getLogger(__name__)
 
-        reference_posterior_samples = []
-
-        # Reject samples outside of prior bounds
-        counter = 0
-        while len(reference_posterior_samples) < num_samples:
-            counter += 1
-            idx = pyro.sample(
-                "mixture_idx",
-                pdist.Categorical(self.simulator_params["mixture_weights"]),
-            )
-            sample = pyro.sample(
-                "posterior_sample",
-                pdist.Normal(
-                    loc=self.simulator_params["mixture_locs_factor"][idx] * observation,
-                    scale=self.simulator_params["mixture_scales"][idx],
-                ),
+        def proposal(num_proposals):
+            # Closed form posterior: mixture of Gaussians centered on the observation
+            idx = pdist.Categorical(self.simulator_params["mixture_weights"]).sample(
+                (num_proposals,)
             )
-            is_outside_prior = torch.isinf(self.prior_dist.log_prob(sample).sum())
-
-            if len(reference_posterior_samples) > 0:
-                is_duplicate = sample in torch.cat(reference_posterior_samples)
-            else:
-                is_duplicate = False
-
-            if not is_outside_prior and not is_duplicate:
-                reference_posterior_samples.append(sample)
-
-        reference_posterior_samples = torch.cat(reference_posterior_samples)
-        acceptance_rate = float(num_samples / counter)
+            return pdist.Normal(
+                loc=self.simulator_params["mixture_locs_factor"][idx].unsqueeze(1)
+                * observation,
+                scale=self.simulator_params["mixture_scales"][idx].unsqueeze(1),
+            ).sample()
+
+        # Reject samples outside of prior bounds and duplicates
+        reference_posterior_samples, acceptance_rate = sample_rejection_batched(
+            proposal, self.prior_dist, num_samples
+        )
 
         log.info(
             f"Acceptance rate for observation {num_observation}: {acceptance_rate}"
         )
+        self.reference_acceptance_rate = acceptance_rate
 
         return reference_posterior_samples
 
@@ -0,0 +1,147 @@
+import logging
+from typing import Callable, Dict
+
+import pyro
+import torch
+from torch.distributions.transforms import Transform, identity_transform
+
+
+def _reduce_to_rows(log_prob: torch.Tensor, batch_size: int) -> torch.Tensor:
+    """Sum a site log prob over all dimensions but the leading batch dimension
+
+    Sites inside plates keep their plate dimensions after the batch dimension,
+    these are summed out. Site log probs that do not depend on the batch (scalars)
+    are broadcast to all rows.
+    """
+    if log_prob.ndim == 0:
+        return log_prob.expand(batch_size)
+    if log_prob.shape[0] != batch_size:
+        raise ValueError(
+            f"Site log prob of shape {tuple(log_prob.shape)} is not aligned with a batch of {batch_size}"
+        )
+    return log_prob.reshape(batch_size, -1).sum(-1)
+
+
+def get_batched_log_prob_fn(
+    conditioned_model: Callable,
+    transforms: Dict[str, Transform],
+) -> Callable:
+    """Gets function returning the unnormalized log probability of a conditioned model
+    for a whole batch of parameters in one model evaluation
+
+    The model is traced once with the `parameters` site conditioned on the full
+    `batch_size` x `dim_parameters` tensor, and the log probs of all sample sites are
+    reduced per row. Like the pyro implementation of `sbibm`, parameters are taken in
+    the space of `transforms` and the log abs det jacobian is accounted for.
+
+    Models with latent sample sites other than `parameters` (e.g. discrete mixture
+    indices that `sbibm` enumerates out) raise a `ValueError`.
+
+    Args:
+        conditioned_model: Model conditioned on the observation
+        transforms: Transforms per site, as returned by `sbibm.utils.pyro.get_log_prob_fn`
+
+    Returns:
+        `log_prob_fn` that returns log probabilities as `batch_size`
+    """
+    transform = transforms.get("parameters", identity_transform)
+
+    def log_prob_fn(parameters: torch.Tensor) -> torch.Tensor:
+        batch_size = parameters.shape[0]
+        parameters_constrained = transform.inv(parameters)
+
+        model = pyro.poutine.condition(
+            conditioned_model, {"parameters": parameters_constrained}
+        )
+        trace = pyro.poutine.trace(model).get_trace()
+        trace.compute_log_prob()
+
+        log_prob = parameters.new_zeros(batch_size)
+        for name, site in trace.nodes.items():
+            if site["type"] != "sample":
+                continue
+            if name != "parameters" and not site["is_observed"]:
+                raise ValueError(f"Latent sample site {name} cannot be batched")
+            log_prob = log_prob + _reduce_to_rows(site["log_prob"], batch_size)
+
+        log_abs_det_jacobian = transform.log_abs_det_jacobian(
+            parameters_constrained, parameters
+        )
+        return log_prob - _reduce_to_rows(log_abs_det_jacobian, batch_size)
+
+    return log_prob_fn
+
+
+def get_batched_log_prob_grad_fn(log_prob_fn: Callable) -> Callable:
+    """Gets function returning gradients of a batched `log_prob_fn`
+
+    Rows of a batch are independent, so one backward pass of the summed log probs
+    yields the gradient of every row.
+
+    Returns:
+        `log_prob_grad_fn` that returns gradients as `batch_size` x `dim_parameter`
+    """
+
+    def log_prob_grad_fn(parameters: torch.Tensor) -> torch.Tensor:
+        with torch.enable_grad():
+            parameters = parameters.detach().requires_grad_(True)
+            (grads,) = torch.autograd.grad(log_prob_fn(parameters).sum(), parameters)
+        return grads
+
+    return log_prob_grad_fn
+
+
+def with_row_fallback(
+    batched_fn: Callable,
+    row_fn: Callable,
+    name: str,
+    num_verify: int = 2,
+    rtol: float = 1e-4,
+    atol: float = 1e-4,
+) -> Callable:
+    """Use a batched function, verified against its row-by-row counterpart
+
+    On the first batch with more than one row, the batched result on the first
+    `num_verify` rows is compared to `row_fn`. If the batched function raises or
+    disagrees, `row_fn` is used for this and all later calls.
+
+    Args:
+        batched_fn: Function evaluating a whole batch at once
+        row_fn: Reference function evaluating the batch row by row
+        name: Name used in log messages
+        num_verify: Number of rows to verify on
+        rtol: Relative tolerance of the verification
+        atol: Absolute tolerance of the verification
+
+    Returns:
+        Function with the signature of `row_fn`
+    """
+    log = logging.getLogger(__name__)
+    state = {"verified": False, "batched": True}
+
+    def fn(parameters: torch.Tensor) -> torch.Tensor:
+        assert parameters.ndim == 2
+
+        if parameters.shape[0] == 1 or not state["batched"]:
+            return row_fn(parameters)
+
+        if not state["verified"]:
+            state["verified"] = True
+            subset = parameters[:num_verify]
+            try:
+                result = batched_fn(subset).detach()
+                reference = row_fn(subset).detach()
+                state["batched"] = result.shape == reference.shape and torch.allclose(
+                    result, reference, rtol=rtol, atol=atol, equal_nan=True
+                )
+                reason = "mismatch with per-row results"
+            except (ValueError, RuntimeError) as e:
+                state["batched"] = False
+                reason = str(e)
+            if not state["batched"]:
+                log.warning(f"Batched {name} unavailable ({reason}), evaluating per row")
+                return row_fn(parameters)
+
+        return batched_fn(parameters)
+
+    return fn
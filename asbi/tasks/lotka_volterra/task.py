@@ -6,12 +6,12 @@ from typing import Callable, List, Optional
 
 import pyro
 import torch
-from diffeqtorch import DiffEq
 from pyro import distributions as pdist
 
 import sbibm  # noqa -- needed for setting sysimage path
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.ode import ODEPool, solve_ode_batched
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task
 from sbibm.utils.decorators import lazy_property
 
 
@@ -21,6 +21,8 @@ class LotkaVolterra(Task):
         days: float = 20.0,
         saveat: float = 0.1,
         summary: Optional[str] = "subsample",
+        n_workers: int = 1,
+        backend: str = "julia",
     ):
         """Lotka-Volterra model
 
@@ -31,6 +33,9 @@ class LotkaVolterra(Task):
             days: Number of days
             saveat: When to save during solving
             summary: Summaries to use
+            n_workers: Number of worker processes solving ODEs in parallel
+            backend: ODE solver, `julia` (diffeqtorch) or `torch` (batched
+                Dormand-Prince solver, no julia dependency)
 
         References:
             [1]: https://mc-stan.org/users/documentation/case-studies/lotka-volterra-predator-prey.html
@@ -44,6 +49,10 @@ class LotkaVolterra(Task):
         else:
             raise NotImplementedError
         self.summary = summary
+        self.n_workers = n_workers
+        if backend not in ["julia", "torch"]:
+            raise NotImplementedError
+        self.backend = backend
 
         # Observation seeds to use when generating ground truth
         observation_seeds = [
@@ -93,6 +102,8 @@ class LotkaVolterra(Task):
 
     @lazy_property
     def de(self):
+        from diffeqtorch import DiffEq
+
         return DiffEq(
             f=f"""
             function f(du,u,p,t)
@@ -106,6 +117,67 @@ class LotkaVolterra(Task):
             debug=False,  # 5
         )
 
+    @lazy_property
+    def ode_pool(self) -> ODEPool:
+        return ODEPool(self, n_workers=self.n_workers)
+
+    def _rhs(self, u: torch.Tensor, parameters: torch.Tensor) -> torch.Tensor:
+        """Right hand side of the ODE for the torch backend"""
+        x, y = u.unbind(-1)
+        alpha, beta, gamma, delta = parameters.unbind(-1)
+        return torch.stack(
+            [alpha * x - beta * x * y, -gamma * y + delta * x * y], dim=-1
+        )
+
+    def solve_ode(self, parameters: torch.Tensor) -> torch.Tensor:
+        """Solve the ODE for a batch of parameters
+
+        Failed solves are returned as NaN trajectories
+
+        Args:
+            parameters: Parameters, `batch_size` x `dim_parameters`
+
+        Returns:
+            Trajectories, `batch_size` x 2 x (days/saveat + 1)
+        """
+        num_samples = parameters.shape[0]
+
+        if self.backend == "torch":
+            t_eval = torch.linspace(
+                float(self.tspan[0]), float(self.tspan[1]), int(self.dim_data_raw / 2)
+            )
+            us = solve_ode_batched(self._rhs, self.u0, t_eval, parameters)
+            return us.float()
+
+        us = []
+        for num_sample in range(num_samples):
+            u, t = self.de(self.u0, self.tspan, parameters[num_sample, :])
+
+            if u.shape != torch.Size([2, int(self.dim_data_raw / 2)]):
+                u = float("nan") * torch.ones((2, int(self.dim_data_raw / 2)))
+                u = u.double()
+
+            if num_sample % 100 == 0:
+                gc.collect()
+                self.de.jl.eval("Base.GC.gc()")
+
+            us.append(u.reshape(1, 2, -1))
+        us = torch.cat(us).float()  # num_parameters x 2 x (days/saveat + 1)
+        return us
+
+    def close(self):
+        """Shut down the ODE worker pool, if one was started"""
+        ode_pool = self.__dict__.pop("_lazy_ode_pool", None)
+        if ode_pool is not None:
+            ode_pool.close()
+
+    def __getstate__(self):
+        # solver and worker pool are process-local and rebuilt lazily
+        state = self.__dict__.copy()
+        state.pop("_lazy_de", None)
+        state.pop("_lazy_ode_pool", None)
+        return state
+
     def get_labels_parameters(self) -> List[str]:
         """Get list containing parameter labels"""
         return [r"$\alpha$", r"$\beta$", r"$\gamma$", r"$\delta$"]
@@ -134,20 +206,10 @@ class LotkaVolterra(Task):
         def simulator(parameters):
             num_samples = parameters.shape[0]
 
-            us = []
-            for num_sample in range(num_samples):
-                u, t = self.de(self.u0, self.tspan, parameters[num_sample, :])
-
-                if u.shape != torch.Size([2, int(self.dim_data_raw / 2)]):
-                    u = float("nan") * torch.ones((2, int(self.dim_data_raw / 2)))
-                    u = u.double()
-
-                if num_sample % 100 == 0:
-                    gc.collect()
-                    self.de.jl.eval("Base.GC.gc()")
-
-                us.append(u.reshape(1, 2, -1))
-            us = torch.cat(us).float()  # num_parameters x 2 x (days/saveat + 1)
+            if self.n_workers > 1:
+                us = self.ode_pool.solve(parameters)
+            else:
+                us = self.solve_ode(parameters)
 
             idx_contains_nan = torch.where(
                 torch.isnan(us.reshape(num_samples, -1)).any(axis=1)
@@ -0,0 +1,222 @@
+from typing import Callable, Optional
+
+import torch
+import torch.multiprocessing as mp
+
+# Dormand-Prince 5(4) tableau
+_DOPRI5_A = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+_DOPRI5_B = [35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0.0]
+_DOPRI5_B_LOW = [
+    5179 / 57600,
+    0.0,
+    7571 / 16695,
+    393 / 640,
+    -92097 / 339200,
+    187 / 2100,
+    1 / 40,
+]
+_DOPRI5_E = [b - b_low for b, b_low in zip(_DOPRI5_B, _DOPRI5_B_LOW)]
+
+# task held by each worker process, with its own warmed-up solver
+_worker_task = None
+
+
+def _init_worker(task, torch_threads: int):
+    """Initialize a worker: keep the task and warm up its solver"""
+    global _worker_task
+    torch.set_num_threads(torch_threads)
+    _worker_task = task
+    # the first solve compiles the julia problem, do it before any shard arrives
+    _worker_task.solve_ode(task.prior_dist.mean.reshape(1, -1))
+
+
+def _solve_shard(parameters: torch.Tensor) -> torch.Tensor:
+    """Solve the ODE for one shard of parameters in a worker"""
+    return _worker_task.solve_ode(parameters)
+
+
+class ODEPool:
+    def __init__(
+        self,
+        task,
+        n_workers: int,
+        chunk_size: Optional[int] = None,
+        torch_threads: int = 1,
+    ):
+        """Process pool solving ODEs of a task in parallel
+
+        Every worker holds its own copy of the task and thereby its own solver,
+        which is warmed up once when the worker starts. Parameter batches are
+        split into shards that are solved concurrently and returned in order.
+        Use as a context manager or call `close` to shut the workers down.
+
+        Args:
+            task: Task implementing `solve_ode(parameters)`, returning the raw
+                trajectories (NaN for failed solves) of a batch of parameters
+            n_workers: Number of worker processes
+            chunk_size: Number of parameters per shard. Defaults to spreading
+                each batch evenly across the workers
+            torch_threads: Number of torch threads per worker
+        """
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self.pool = mp.get_context("spawn").Pool(
+            n_workers, initializer=_init_worker, initargs=(task, torch_threads)
+        )
+
+    def solve(self, parameters: torch.Tensor) -> torch.Tensor:
+        """Solve the ODE for a batch of parameters
+
+        Args:
+            parameters: Parameters, `batch_size` x `dim_parameters`
+
+        Returns:
+            Trajectories in the same order as `parameters`
+        """
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = max(1, -(-parameters.shape[0] // self.n_workers))
+        shards = torch.split(parameters, chunk_size)
+        return torch.cat(list(self.pool.imap(_solve_shard, shards)))
+
+    def close(self):
+        """Shut down the worker processes, the pool cannot be used afterwards"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _rk4_step(f: Callable, u: torch.Tensor, parameters: torch.Tensor, h: float):
+    """Classical Runge-Kutta step"""
+    k1 = f(u, parameters)
+    k2 = f(u + 0.5 * h * k1, parameters)
+    k3 = f(u + 0.5 * h * k2, parameters)
+    k4 = f(u + h * k3, parameters)
+    return u + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+
+def _dopri5_step(f: Callable, u: torch.Tensor, parameters: torch.Tensor, h: torch.Tensor):
+    """Dormand-Prince step with per-trajectory step sizes, returns solution and error"""
+    h = h.unsqueeze(-1)
+    ks = []
+    for a in _DOPRI5_A:
+        du = sum(a_j * k for a_j, k in zip(a, ks) if a_j != 0.0) if a else 0.0
+        ks.append(f(u + h * du, parameters))
+    u_new = u + h * sum(b * k for b, k in zip(_DOPRI5_B, ks) if b != 0.0)
+    error = h * sum(e * k for e, k in zip(_DOPRI5_E, ks) if e != 0.0)
+    return u_new, error
+
+
+def solve_ode_batched(
+    f: Callable,
+    u0: torch.Tensor,
+    t_eval: torch.Tensor,
+    parameters: torch.Tensor,
+    method: str = "dopri5",
+    rtol: float = 1e-8,
+    atol: float = 1e-8,
+    num_substeps: int = 10,
+    max_steps: int = 100000,
+) -> torch.Tensor:
+    """Solve an autonomous ODE for a batch of parameters in torch
+
+    The whole batch is integrated as one tensor state. With `dopri5`, every
+    trajectory adapts its own step size and steps are clipped to land exactly on
+    the points in `t_eval`. With `rk4`, all trajectories take `num_substeps`
+    fixed steps between consecutive points in `t_eval`.
+
+    Trajectories that become non-finite or do not reach the end within
+    `max_steps` are returned as NaN, mirroring failed solves of the julia backend.
+
+    Args:
+        f: Right hand side `f(u, parameters)`, `batch_size` x `dim_state`
+        u0: Initial state, `dim_state`
+        t_eval: Times at which the solution is saved, starting at the initial time
+        parameters: Parameters, `batch_size` x `dim_parameters`
+        method: `dopri5` (adaptive) or `rk4` (fixed step)
+        rtol: Relative tolerance of `dopri5`
+        atol: Absolute tolerance of `dopri5`
+        num_substeps: Number of `rk4` steps between save points
+        max_steps: Maximum number of `dopri5` steps
+
+    Returns:
+        Solutions in float64, `batch_size` x `dim_state` x `len(t_eval)`
+    """
+    dtype = torch.float64
+    num_samples = parameters.shape[0]
+    parameters = parameters.to(dtype)
+    t_eval = t_eval.to(dtype)
+    u = u0.to(dtype).expand(num_samples, -1).clone()
+
+    us = torch.full((num_samples, len(t_eval), u.shape[1]), float("nan"), dtype=dtype)
+    us[:, 0] = u
+
+    if method == "rk4":
+        for i in range(1, len(t_eval)):
+            h = float(t_eval[i] - t_eval[i - 1]) / num_substeps
+            for _ in range(num_substeps):
+                u = _rk4_step(f, u, parameters, h)
+            us[:, i] = u
+        failed = ~torch.isfinite(us).all(dim=2).all(dim=1)
+
+    elif method == "dopri5":
+        t = torch.full((num_samples,), float(t_eval[0]), dtype=dtype)
+        h = torch.full((num_samples,), 0.01 * float(t_eval[1] - t_eval[0]), dtype=dtype)
+        idx_next = torch.ones(num_samples, dtype=torch.long)
+        failed = torch.zeros(num_samples, dtype=torch.bool)
+        eps = 1e-12 * float(t_eval[-1] - t_eval[0])
+
+        for _ in range(max_steps):
+            active = torch.where((idx_next < len(t_eval)) & ~failed)[0]
+            if len(active) == 0:
+                break
+
+            u_a, t_a, h_a = u[active], t[active], h[active]
+            t_next = t_eval[idx_next[active]]
+            h_try = torch.minimum(h_a, t_next - t_a)
+            u_new, error = _dopri5_step(f, u_a, parameters[active], h_try)
+
+            scale = atol + rtol * torch.maximum(u_a.abs(), u_new.abs())
+            error_norm = (error / scale).pow(2).mean(dim=1).sqrt()
+            accept = error_norm <= 1.0
+            factor = (0.9 * error_norm.clamp(min=1e-10) ** -0.2).clamp(0.2, 10.0)
+
+            t_a = torch.where(accept, t_a + h_try, t_a)
+            u_a = torch.where(accept.unsqueeze(-1), u_new, u_a)
+            # accepted steps clipped to a save point keep their unclipped step size
+            h_a = torch.where(
+                accept & (h_try < h_a),
+                torch.maximum(h_a, h_try * factor),
+                h_try * factor,
+            )
+
+            reached = accept & ((t_a - t_next).abs() <= eps)
+            us[active[reached], idx_next[active[reached]]] = u_a[reached]
+            idx_next[active[reached]] += 1
+
+            u[active], t[active], h[active] = u_a, t_a, h_a
+            failed[active] = ~torch.isfinite(u_a).all(dim=1) | (h_a <= eps)
+
+        failed = failed | (idx_next < len(t_eval))
+
+    else:
+        raise NotImplementedError
+
+    us[failed] = float("nan")
+    return us.transpose(1, 2)
+
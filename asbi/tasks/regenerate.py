@@ -0,0 +1,192 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from asbi.tasks import get_available_tasks, get_task
+
+
+def get_setup_jobs(
+    task_names: List[str],
+    num_observations: Optional[List[int]] = None,
+    force: bool = False,
+) -> List[Tuple[str, int, int]]:
+    """Get the (task, observation number, observation seed) jobs to regenerate
+
+    Observations whose files exist and verify are skipped, unless `force` is set.
+    Task variants that share their files with an earlier task (e.g.
+    `bernoulli_glm_raw` and `bernoulli_glm`) are only set up once: every variant
+    verifies and regenerates the files read by all variants of its task (e.g.
+    `observation_distractors.csv` of `slcp_distractors`).
+
+    Args:
+        task_names: Names of tasks
+        num_observations: Observation numbers to consider, defaults to all
+        force: If True, regenerates observations even if they verify
+
+    Returns:
+        List of jobs
+    """
+    log = logging.getLogger(__name__)
+
+    jobs = []
+    task_paths = {}
+    for task_name in task_names:
+        try:
+            task = get_task(task_name)
+        except Exception as e:
+            # e.g. ode tasks whose julia backend is not installed
+            log.warning(f"Skipping {task_name}: {e}")
+            continue
+        if task.path in task_paths:
+            log.info(f"Skipping {task_name}, it shares files with {task_paths[task.path]}")
+            continue
+        task_paths[task.path] = task_name
+
+        observations = enumerate(task.observation_seeds, start=1)
+        for num_observation, observation_seed in observations:
+            if num_observations and num_observation not in num_observations:
+                continue
+            if not force and task._verify_observation(num_observation):
+                continue
+            jobs.append((task_name, num_observation, int(observation_seed)))
+    return jobs
+
+
+def _init_worker(torch_threads: int):
+    torch.set_num_threads(torch_threads)
+
+
+def _run_setup_job(
+    task_name: str,
+    num_observation: int,
+    observation_seed: int,
+    create_reference: bool = True,
+) -> Dict[str, Any]:
+    """Generate one observation and its reference posterior samples"""
+    start = time.time()
+    task = get_task(task_name)
+    info = task._setup_observation(
+        num_observation, observation_seed, create_reference=create_reference
+    )
+    info["time"] = time.time() - start
+    info["verified"] = not create_reference or task._verify_observation(num_observation)
+    return info
+
+
+def run_setup_jobs(
+    jobs: List[Tuple[str, int, int]],
+    n_workers: int = 1,
+    create_reference: bool = True,
+) -> int:
+    """Run setup jobs in a process pool, logging acceptance rate and time per job
+
+    Args:
+        jobs: Jobs as returned by `get_setup_jobs`
+        n_workers: Number of processes
+        create_reference: If False, skips reference creation
+
+    Returns:
+        Number of failed jobs
+    """
+    log = logging.getLogger(__name__)
+    if not jobs:
+        log.info("All observations verify, nothing to regenerate")
+        return 0
+
+    n_workers = max(1, min(n_workers, len(jobs)))
+    torch_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    log.info(f"Regenerating {len(jobs)} observations with {n_workers} workers")
+
+    num_failed = 0
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(torch_threads,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                _run_setup_job, *job, create_reference=create_reference
+            ): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            task_name, num_observation, observation_seed = futures[future]
+            job_name = (
+                f"{task_name} observation {num_observation} (seed {observation_seed})"
+            )
+            try:
+                info = future.result()
+            except Exception as e:
+                num_failed += 1
+                log.error(f"{job_name} failed: {e!r}")
+                continue
+
+            acceptance_rate = info["acceptance_rate"]
+            acceptance_rate = "n/a" if acceptance_rate is None else f"{acceptance_rate:.4f}"
+            log.info(
+                f"{job_name}: {info['time']:.1f}s, acceptance rate {acceptance_rate}"
+                + ("" if info["verified"] else ", FAILED verification")
+            )
+            num_failed += not info["verified"]
+
+    return num_failed
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="regenerate missing or incomplete task reference data"
+    )
+    parser.add_argument(
+        "tasks", nargs="*", help="tasks to set up (default: all available tasks)"
+    )
+    parser.add_argument(
+        "--num-observations",
+        nargs="+",
+        type=int,
+        default=None,
+        help="observation numbers to set up (default: all)",
+    )
+    parser.add_argument(
+        "--n-workers", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="regenerate observations even if they verify",
+    )
+    parser.add_argument(
+        "--no-reference",
+        action="store_true",
+        help="skip reference posterior samples",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only list the jobs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    log = logging.getLogger(__name__)
+
+    task_names = args.tasks if args.tasks else get_available_tasks()
+    jobs = get_setup_jobs(
+        task_names, num_observations=args.num_observations, force=args.force
+    )
+    if args.dry_run:
+        for task_name, num_observation, observation_seed in jobs:
+            log.info(f"{task_name} observation {num_observation} (seed {observation_seed})")
+        return
+
+    num_failed = run_setup_jobs(
+        jobs, n_workers=args.n_workers, create_reference=not args.no_reference
+    )
+    if num_failed:
+        raise SystemExit(f"{num_failed} of {len(jobs)} jobs failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import math
+from typing import Callable, Tuple
+
+import torch
+
+
+def unique_rows(samples: torch.Tensor) -> torch.Tensor:
+    """Remove duplicate rows, keeping the first occurrence of each row in order"""
+    if len(samples) == 0:
+        return samples
+    _, inverse = torch.unique(samples, dim=0, return_inverse=True)
+    first = torch.full((int(inverse.max()) + 1,), len(samples), dtype=torch.long)
+    first = first.scatter_reduce(
+        0, inverse, torch.arange(len(samples)), reduce="amin", include_self=True
+    )
+    return samples[torch.sort(first).values]
+
+
+def sample_rejection_batched(
+    proposal: Callable[[int], torch.Tensor],
+    prior_dist: torch.distributions.Distribution,
+    num_samples: int,
+    initial_block_size: int = 10_000,
+    max_block_size: int = 1_000_000,
+) -> Tuple[torch.Tensor, float]:
+    """Rejection sampling of a proposal restricted to the support of the prior
+
+    Proposes blocks of samples at once, rejects samples outside of the prior
+    support with one vectorized `log_prob`, and removes duplicates with a single
+    `unique` pass. After each block, the block size is adapted to the observed
+    acceptance rate, so that the next block is expected to complete the samples.
+
+    Args:
+        proposal: Function returning `block_size` proposed samples
+        prior_dist: Prior, samples with infinite log prob are rejected
+        num_samples: Number of samples to generate
+        initial_block_size: Size of the first block of proposals
+        max_block_size: Maximum size of a block of proposals
+
+    Returns:
+        Samples in proposal order, `num_samples` x `dim`, and acceptance rate
+    """
+    accepted = []
+    num_accepted = 0
+    num_proposed = 0
+    block_size = initial_block_size
+
+    while num_accepted < num_samples:
+        block = proposal(block_size)
+        num_proposed += block_size
+
+        is_inside_prior = torch.isfinite(prior_dist.log_prob(block))
+        accepted.append(block[is_inside_prior])
+        samples = unique_rows(torch.cat(accepted))
+        accepted = [samples]
+        num_accepted = len(samples)
+
+        # size the next block by the acceptance rate so far, with some slack
+        acceptance_rate = max(num_accepted, 1) / num_proposed
+        num_missing = num_samples - num_accepted
+        block_size = min(
+            max_block_size, max(1000, math.ceil(1.2 * num_missing / acceptance_rate))
+        )
+
+    return samples[:num_samples], num_accepted / num_proposed
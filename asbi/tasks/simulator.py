@@ -1,8 +1,14 @@
-from typing import Any, Callable, Optional
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
 
+import numpy as np
 import torch
 
-from sbibm.tasks.task import Task
+from asbi.tasks.task import Task
 from sbibm.utils.exceptions import SimulationBudgetExceeded
 
 
@@ -60,3 +66,177 @@ class Simulator:
         self.num_simulations += requested_simulations
 
         return self.flatten_data(data)
+
+
+class CachedSimulator:
+    def __init__(
+        self,
+        simulator: Simulator,
+        path: Union[str, Path],
+        max_size_bytes: Optional[int] = None,
+        seed: int = 0,
+    ):
+        """Simulator with a persistent simulation cache
+
+        Wraps a `Simulator` and memoizes simulations on disk in a SQLite store,
+        content-addressed by a hash of (task name, parameters, seed). Parameters
+        that were simulated before under the same seed return the stored data
+        instead of being re-simulated, across calls, runs and processes.
+
+        Missing parameters are simulated in one batch, under a torch seed derived
+        from the keys of the whole batch, and the global random state is left
+        untouched. Determinism is per batch: a cold cache reproduces the same data
+        when it is asked for the same missing parameters in the same order, but a
+        parameter simulated in a different batch gets different data. Seeding
+        each row on its own would need one simulator call per row. Identical
+        parameters under the same seed share one simulation; use different seeds
+        (e.g. the repeat index) for independent replicates.
+
+        Calls with keyword arguments (e.g. `return_both`) bypass the cache.
+
+        Args:
+            simulator: Simulator to wrap, its `max_calls` budget only counts misses
+            path: Path to the SQLite file of the cache
+            max_size_bytes: If set, least recently used entries are evicted once
+                the stored data exceeds this size
+            seed: Seed of the simulations, part of the cache key
+        """
+        self.simulator = simulator
+        self.path = Path(path)
+        self.max_size_bytes = max_size_bytes
+        self.seed = seed
+        self.num_simulations = 0
+        self.num_hits = 0
+
+        self.name = simulator.name
+        self.dim_data = simulator.dim_data
+        self.dim_parameters = simulator.dim_parameters
+        self.flatten_data = simulator.flatten_data
+        self.unflatten_data = simulator.unflatten_data
+
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, timeout=60, check_same_thread=False
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS simulations "
+                "(key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_access REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_access ON simulations (last_access)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def __getstate__(self):
+        # connections are process-local and reopened lazily
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, parameters: torch.Tensor, **kwargs: Any) -> torch.Tensor:
+        if parameters.ndim == 1:
+            parameters = parameters.reshape(1, -1)
+
+        if kwargs:
+            return self.simulator(parameters, **kwargs)
+
+        # the connection may be shared with simulation threads
+        with self._lock:
+            return self._call_cached(parameters)
+
+    def _call_cached(self, parameters: torch.Tensor) -> torch.Tensor:
+        keys = self._get_keys(parameters)
+        data = self._load(keys)
+
+        missing = list(dict.fromkeys(key for key in keys if key not in data))
+        if missing:
+            idx_missing = [keys.index(key) for key in missing]
+            # one seed for the batch, so the simulator still runs once for all misses
+            seed = int(hashlib.sha256("".join(missing).encode()).hexdigest()[:15], 16)
+            with torch.random.fork_rng(devices=[]):
+                torch.manual_seed(seed)
+                data_missing = self.simulator(parameters[idx_missing])
+            simulated = dict(zip(missing, data_missing.float()))
+            self._store(simulated)
+            data.update(simulated)
+
+        self.num_simulations += len(keys)
+        self.num_hits += len(keys) - len(missing)
+
+        return torch.stack([data[key] for key in keys])
+
+    def _get_keys(self, parameters: torch.Tensor) -> List[str]:
+        """Content hashes of (task name, parameters, seed) for each row"""
+        prefix = f"{self.name}/{self.seed}/".encode()
+        rows = parameters.detach().cpu().numpy().astype(np.float32)
+        return [hashlib.sha256(prefix + row.tobytes()).hexdigest() for row in rows]
+
+    def _load(self, keys: List[str]) -> Dict[str, torch.Tensor]:
+        """Load stored data for keys, marking them as recently used"""
+        unique_keys = list(dict.fromkeys(keys))
+        data = {}
+        # stay below SQLite's limit on the number of query variables
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i : i + 500]
+            rows = self.connection.execute(
+                f"SELECT key, data FROM simulations WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            for key, blob in rows:
+                data[key] = torch.from_numpy(np.frombuffer(blob, dtype=np.float32).copy())
+
+        if data:
+            now = time.time()
+            self.connection.executemany(
+                "UPDATE simulations SET last_access = ? WHERE key = ?",
+                [(now, key) for key in data],
+            )
+            self.connection.commit()
+        return data
+
+    def _store(self, data: Dict[str, torch.Tensor]):
+        """Store simulated data and evict least recently used entries over the size cap"""
+        now = time.time()
+        rows = []
+        for key, x in data.items():
+            blob = x.cpu().numpy().astype(np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO simulations VALUES (?, ?, ?, ?)", rows
+        )
+        self.connection.commit()
+
+        if self.max_size_bytes is not None:
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits `max_size_bytes`"""
+        total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM simulations"
+        ).fetchone()[0]
+        excess = total_size - self.max_size_bytes
+        if excess <= 0:
+            return
+
+        evicted = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM simulations ORDER BY last_access"
+        ):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.connection.executemany("DELETE FROM simulations WHERE key = ?", evicted)
+        self.connection.commit()
@@ -4,12 +4,12 @@ from typing import Callable, List, Optional
 
 import pyro
 import torch
-from diffeqtorch import DiffEq
 from pyro import distributions as pdist
 
 import sbibm  # noqa -- needed for setting sysimage path
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.ode import ODEPool, solve_ode_batched
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task
 from sbibm.utils.decorators import lazy_property
 
 
@@ -23,6 +23,8 @@ class SIR(Task):
         saveat: float = 1.0,
         total_count: int = 1000,
         summary: Optional[str] = "subsample",
+        n_workers: int = 1,
+        backend: str = "julia",
     ):
         """SIR epidemic model
 
@@ -37,6 +39,9 @@ class SIR(Task):
             days: Number of days
             saveat: When to save during solving
             summary: Summaries to use
+            n_workers: Number of worker processes solving ODEs in parallel
+            backend: ODE solver, `julia` (diffeqtorch) or `torch` (batched
+                Dormand-Prince solver, no julia dependency)
 
         References:
             [1]: https://jrmihalj.github.io/estimating-transmission-by-fitting-mechanistic-models-in-Stan/
@@ -50,6 +55,10 @@ class SIR(Task):
         else:
             raise NotImplementedError
         self.summary = summary
+        self.n_workers = n_workers
+        if backend not in ["julia", "torch"]:
+            raise NotImplementedError
+        self.backend = backend
         self.total_count = total_count
 
         # Observation seeds to use when generating ground truth
@@ -96,6 +105,8 @@ class SIR(Task):
 
     @lazy_property
     def de(self):
+        from diffeqtorch import DiffEq
+
         return DiffEq(
             f=f"""
             function f(du,u,p,t)
@@ -110,6 +121,63 @@ class SIR(Task):
             debug=False,  # 5
         )
 
+    @lazy_property
+    def ode_pool(self) -> ODEPool:
+        return ODEPool(self, n_workers=self.n_workers)
+
+    def _rhs(self, u: torch.Tensor, parameters: torch.Tensor) -> torch.Tensor:
+        """Right hand side of the ODE for the torch backend"""
+        S, I, R = u.unbind(-1)
+        b, g = parameters.unbind(-1)
+        return torch.stack(
+            [-b * S * I / self.N, b * S * I / self.N - g * I, g * I], dim=-1
+        )
+
+    def solve_ode(self, parameters: torch.Tensor) -> torch.Tensor:
+        """Solve the ODE for a batch of parameters
+
+        Failed solves are returned as NaN trajectories
+
+        Args:
+            parameters: Parameters, `batch_size` x `dim_parameters`
+
+        Returns:
+            Trajectories, `batch_size` x 3 x (days/saveat + 1)
+        """
+        num_samples = parameters.shape[0]
+
+        if self.backend == "torch":
+            t_eval = torch.linspace(
+                float(self.tspan[0]), float(self.tspan[1]), int(self.dim_data_raw / 3)
+            )
+            us = solve_ode_batched(self._rhs, self.u0, t_eval, parameters)
+            return us.float()
+
+        us = []
+        for num_sample in range(num_samples):
+            u, t = self.de(self.u0, self.tspan, parameters[num_sample, :])
+
+            if u.shape != torch.Size([3, int(self.dim_data_raw / 3)]):
+                u = float("nan") * torch.ones((3, int(self.dim_data_raw / 3)))
+                u = u.double()
+
+            us.append(u.reshape(1, 3, -1))
+        us = torch.cat(us).float()  # num_parameters x 3 x (days/saveat + 1)
+        return us
+
+    def close(self):
+        """Shut down the ODE worker pool, if one was started"""
+        ode_pool = self.__dict__.pop("_lazy_ode_pool", None)
+        if ode_pool is not None:
+            ode_pool.close()
+
+    def __getstate__(self):
+        # solver and worker pool are process-local and rebuilt lazily
+        state = self.__dict__.copy()
+        state.pop("_lazy_de", None)
+        state.pop("_lazy_ode_pool", None)
+        return state
+
     def get_labels_parameters(self) -> List[str]:
         """Get list containing parameter labels"""
         return [r"$\beta$", r"$\gamma$"]
@@ -138,16 +206,10 @@ class SIR(Task):
         def simulator(parameters):
             num_samples = parameters.shape[0]
 
-            us = []
-            for num_sample in range(num_samples):
-                u, t = self.de(self.u0, self.tspan, parameters[num_sample, :])
-
-                if u.shape != torch.Size([3, int(self.dim_data_raw / 3)]):
-                    u = float("nan") * torch.ones((3, int(self.dim_data_raw / 3)))
-                    u = u.double()
-
-                us.append(u.reshape(1, 3, -1))
-            us = torch.cat(us).float()  # num_parameters x 3 x (days/saveat + 1)
+            if self.n_workers > 1:
+                us = self.ode_pool.solve(parameters)
+            else:
+                us = self.solve_ode(parameters)
 
             idx_contains_nan = torch.where(
                 torch.isnan(us.reshape(num_samples, -1)).any(axis=1)
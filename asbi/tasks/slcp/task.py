@@ -5,8 +5,8 @@ import pyro
 import torch
 from pyro import distributions as pdist
 
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task, get_tensor_from_binary_cache, load_static_asset
 from sbibm.utils.io import get_tensor_from_csv, save_tensor_to_csv
 
 
@@ -116,12 +116,12 @@ class SLCP(Task):
             else:
                 data = pyro.sample("data", data_dist).reshape((num_samples, 8))
 
-                gmm = torch.load(self.path / "files" / "gmm.torch")
+                gmm = load_static_asset(self.path / "files" / "gmm.torch")
                 noise = gmm.sample((num_samples,)).type(data.dtype)
 
                 data_and_noise = torch.cat([data, noise], dim=1)
 
-                permutation_idx = torch.load(
+                permutation_idx = load_static_asset(
                     self.path / "files" / "permutation_idx.torch"
                 )
 
@@ -138,7 +138,7 @@ class SLCP(Task):
                 / f"num_observation_{num_observation}"
                 / "observation.csv"
             )
-            return get_tensor_from_csv(path)
+            return get_tensor_from_binary_cache(path)
         else:
             path = (
                 self.path
@@ -146,7 +146,7 @@ class SLCP(Task):
                 / f"num_observation_{num_observation}"
                 / "observation_distractors.csv"
             )
-            return get_tensor_from_csv(path)
+            return get_tensor_from_binary_cache(path)
 
     def _get_transforms(
         self,
@@ -240,6 +240,87 @@ class SLCP(Task):
             proposal_dist=proposal_dist,
         )
 
+    def _setup_observation(
+        self,
+        num_observation: int,
+        observation_seed: int,
+        create_reference: bool = True,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """Generate and save observation and reference posterior samples for one
+        observation number, including the observation with distractors
+
+        Both variants share their files, which are always generated from the task
+        without distractors.
+
+        See `Task._setup_observation`
+        """
+        if self.distractors:
+            return SLCP(distractors=False)._setup_observation(
+                num_observation,
+                observation_seed,
+                create_reference=create_reference,
+                **kwargs,
+            )
+
+        info = super()._setup_observation(
+            num_observation,
+            observation_seed,
+            create_reference=create_reference,
+            **kwargs,
+        )
+        self._save_observation_distractors(num_observation)
+        return info
+
+    def _verify_observation(self, num_observation: int) -> bool:
+        """Check that the files of an observation number, including the observation
+        with distractors, exist and are complete"""
+        if self.distractors:
+            return SLCP(distractors=False)._verify_observation(num_observation)
+
+        path = (
+            self.path
+            / "files"
+            / f"num_observation_{num_observation}"
+            / "observation_distractors.csv"
+        )
+        try:
+            observation_distractors = get_tensor_from_csv(path)
+        except (OSError, ValueError, KeyError, EOFError):
+            return False
+        return observation_distractors.shape == (1, 100) and super()._verify_observation(
+            num_observation
+        )
+
+    def _save_observation_distractors(self, num_observation: int):
+        """Save the observation with distractors of an observation number
+
+        The noise of observation `num_observation` is the `num_observation`-th draw
+        of the distractor mixture after seeding with 42, as in
+        `_generate_noise_dist_parameters`.
+        """
+        gmm = load_static_asset(self.path / "files" / "gmm.torch")
+        permutation_idx = load_static_asset(
+            self.path / "files" / "permutation_idx.torch"
+        )
+
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(42)
+            for _ in range(num_observation):
+                noise = gmm.sample()
+
+        observation = self.get_observation(num_observation)
+        noise = noise.reshape((1, -1)).type(observation.dtype)
+        observation_and_noise = torch.cat([observation, noise], dim=1)
+
+        path = (
+            self.path
+            / "files"
+            / f"num_observation_{num_observation}"
+            / "observation_distractors.csv"
+        )
+        SLCP(distractors=True).save_data(path, observation_and_noise[:, permutation_idx])
+
     def _generate_noise_dist_parameters(self):
         import numpy as np
 
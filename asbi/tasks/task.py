@@ -1,3 +1,6 @@
+import hashlib
+import os
+import tempfile
 from abc import abstractmethod
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Union
@@ -7,8 +10,120 @@ import pandas as pd
 import pyro
 import torch
 
+from asbi.tasks.log_prob import (
+    get_batched_log_prob_fn,
+    get_batched_log_prob_grad_fn,
+    with_row_fallback,
+)
 from sbibm.utils.io import get_tensor_from_csv, save_tensor_to_csv
 from sbibm.utils.pyro import get_log_prob_fn, get_log_prob_grad_fn
+from sbibm.utils.torch import get_default_device
+
+# csv files per observation that are mirrored by binary `.npy` caches
+CACHED_FILES = [
+    "observation.csv",
+    "true_parameters.csv",
+    "reference_posterior_samples.csv.bz2",
+    # observations of task variants (bernoulli_glm_raw, slcp_distractors)
+    "observation_raw.csv",
+    "observation_distractors.csv",
+]
+
+# csv paths whose cache was validated in this process, keyed to (mtime, size) of the csv
+_validated_caches: Dict[Path, tuple] = {}
+
+# static task assets loaded in this process, with the (mtime, size) of their file
+_static_assets: Dict[Path, tuple] = {}
+
+
+def load_static_asset(path: Union[str, Path]) -> Any:
+    """Load a static task asset (e.g. `.pt` or `.torch` files) once per process
+
+    The asset is reloaded if its file changed, e.g. after re-running `_setup`. The
+    returned object is shared between all callers and must not be modified in place.
+    """
+    path = Path(path)
+    stat = path.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if path not in _static_assets or _static_assets[path][0] != key:
+        _static_assets[path] = (key, torch.load(path))
+    return _static_assets[path][1]
+
+
+def _sha256(path: Path) -> str:
+    """Checksum of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _get_cache_paths(path: Path):
+    """Paths of the `.npy` cache and its checksum file for a csv file"""
+    stem = path.name.split(".")[0]
+    return path.with_name(f"{stem}.npy"), path.with_name(f"{stem}.sha256")
+
+
+def build_binary_cache(path: Union[str, Path], force: bool = False) -> bool:
+    """Build the `.npy` cache of a csv file, unless a valid one exists
+
+    The cache stores the parsed float32 array next to the csv, together with the
+    sha256 checksum of the csv it was built from. A cache whose checksum does not
+    match the current csv (e.g. after re-running `_setup`) is rebuilt.
+
+    Args:
+        path: Path to csv file
+        force: If True, rebuilds the cache even if it is valid
+
+    Returns:
+        True if the cache was (re)built, False if an existing cache was valid
+    """
+    path = Path(path)
+    npy_path, checksum_path = _get_cache_paths(path)
+    checksum = _sha256(path)
+    if (
+        not force
+        and npy_path.exists()
+        and checksum_path.exists()
+        and checksum_path.read_text().strip() == checksum
+    ):
+        return False
+
+    array = np.atleast_2d(pd.read_csv(path)).astype(np.float32)
+    # write to temporary files first, so concurrent readers never see partial caches
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".npy.tmp")
+    with os.fdopen(fd, "wb") as fh:
+        np.save(fh, array)
+    os.replace(tmp_path, npy_path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".sha256.tmp")
+    with os.fdopen(fd, "w") as fh:
+        fh.write(checksum)
+    os.replace(tmp_path, checksum_path)
+    return True
+
+
+def get_tensor_from_binary_cache(path: Union[str, Path]) -> torch.Tensor:
+    """Get `torch.Tensor` for a csv file through its memory-mapped `.npy` cache
+
+    The cache is built lazily on first access and validated against the csv
+    checksum once per process. Falls back to parsing the csv if the cache cannot
+    be written (e.g. read-only installs).
+    """
+    path = Path(path)
+    npy_path, _ = _get_cache_paths(path)
+    stat = path.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _validated_caches.get(path) != key:
+        try:
+            build_binary_cache(path)
+        except OSError:
+            return get_tensor_from_csv(path)
+        _validated_caches[path] = key
+
+    # copy-on-write mapping: no copy on load, and writes never reach the file
+    array = np.load(npy_path, mmap_mode="c")
+    return torch.from_numpy(array).to(get_default_device())
 
 
 class Task:
@@ -64,6 +179,21 @@ class Task:
             if observation_seeds is not None
             else [i + 1000000 for i in range(self.num_observations)]
         )
+        # acceptance rate of the last reference posterior sampling, if reported
+        self.reference_acceptance_rate: Optional[float] = None
+
+    def close(self):
+        """Release process-level resources of the task, e.g. worker pools
+
+        Tasks stay usable afterwards, resources are recreated lazily when needed.
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     @abstractmethod
     def get_prior(self) -> Callable:
@@ -94,7 +224,7 @@ class Task:
             / f"num_observation_{num_observation}"
             / "observation.csv"
         )
-        return get_tensor_from_csv(path)
+        return get_tensor_from_binary_cache(path)
 
     def get_reference_posterior_samples(self, num_observation: int) -> torch.Tensor:
         """Get reference posterior samples for a given observation number"""
@@ -104,7 +234,7 @@ class Task:
             / f"num_observation_{num_observation}"
             / "reference_posterior_samples.csv.bz2"
         )
-        return get_tensor_from_csv(path)
+        return get_tensor_from_binary_cache(path)
 
     @abstractmethod
     def get_simulator(self) -> Callable:
@@ -119,7 +249,25 @@ class Task:
             / f"num_observation_{num_observation}"
             / "true_parameters.csv"
         )
-        return get_tensor_from_csv(path)
+        return get_tensor_from_binary_cache(path)
+
+    def build_binary_caches(self, force: bool = False) -> int:
+        """Build the binary caches of observations, true parameters and reference
+        posterior samples for all observations of the task
+
+        Args:
+            force: If True, rebuilds caches even if they are valid
+
+        Returns:
+            Number of caches that were (re)built
+        """
+        num_built = 0
+        for num_observation in range(1, self.num_observations + 1):
+            for name in CACHED_FILES:
+                path = self.path / "files" / f"num_observation_{num_observation}" / name
+                if path.exists():
+                    num_built += build_binary_cache(path, force=force)
+        return num_built
 
     def save_data(self, path: Union[str, Path], data: torch.Tensor):
         """Save data to a given path"""
@@ -155,6 +303,10 @@ class Task:
         """Gets function returning the unnormalized log probability of the posterior or
         likelihood
 
+        With implementation `pyro`, batches are evaluated in one pass through the
+        conditioned model, verified once against the per-row evaluation which is
+        used instead for models that cannot be batched (see `asbi.tasks.log_prob`).
+
         Args:
             num_observation: Observation number
             observation: Instead of passing an observation number, an observation may be
@@ -176,7 +328,7 @@ class Task:
             posterior=posterior,
         )
 
-        log_prob_fn, _ = get_log_prob_fn(
+        log_prob_fn, transforms = get_log_prob_fn(
             conditioned_model,
             implementation=implementation,
             **kwargs,
@@ -200,7 +352,11 @@ class Task:
             return log_prob_fn({"parameters": parameters})
 
         if implementation == "pyro":
-            return log_prob_pyro
+            return with_row_fallback(
+                get_batched_log_prob_fn(conditioned_model, transforms),
+                log_prob_pyro,
+                name=f"log prob of {self.name}",
+            )
         elif implementation == "experimental":
             return log_prob_experimental
         else:
@@ -216,6 +372,9 @@ class Task:
     ) -> Callable:
         """Gets function returning the unnormalized log probability of the posterior
 
+        Batches are differentiated in one backward pass of the batched log prob,
+        with the per-row evaluation as verified fallback (see `_get_log_prob_fn`).
+
         Args:
             num_observation: Observation number
             observation: Instead of passing an observation number, an observation may be
@@ -238,7 +397,7 @@ class Task:
             observation=observation,
             posterior=posterior,
         )
-        log_prob_grad_fn, _ = get_log_prob_grad_fn(
+        log_prob_grad_fn, transforms = get_log_prob_grad_fn(
             conditioned_model,
             implementation=implementation,
             **kwargs,
@@ -265,7 +424,13 @@ class Task:
                 )
 
         if implementation == "pyro":
-            return log_prob_grad_pyro
+            return with_row_fallback(
+                get_batched_log_prob_grad_fn(
+                    get_batched_log_prob_fn(conditioned_model, transforms)
+                ),
+                log_prob_grad_pyro,
+                name=f"log prob gradient of {self.name}",
+            )
         else:
             raise NotImplementedError
 
@@ -415,12 +580,91 @@ class Task:
         path.parent.mkdir(parents=True, exist_ok=True)
         self.save_parameters(path, true_parameters)
 
+    def _verify_observation(self, num_observation: int) -> bool:
+        """Check that the files of an observation number exist and are complete
+
+        Checks the observation seed against `observation_seeds`, the shapes of true
+        parameters, observation and reference posterior samples, and that reference
+        posterior samples are finite.
+        """
+        path = self.path / "files" / f"num_observation_{num_observation}"
+        try:
+            observation_seed = self._get_observation_seed(num_observation)
+            true_parameters = get_tensor_from_csv(path / "true_parameters.csv")
+            observation = get_tensor_from_csv(path / "observation.csv")
+            reference_posterior_samples = get_tensor_from_csv(
+                path / "reference_posterior_samples.csv.bz2"
+            )
+        except (OSError, ValueError, KeyError, EOFError):
+            return False
+
+        return (
+            observation_seed == self.observation_seeds[num_observation - 1]
+            and true_parameters.shape == (1, self.dim_parameters)
+            and observation.shape == (1, self.dim_data)
+            and reference_posterior_samples.shape
+            == (self.num_reference_posterior_samples, self.dim_parameters)
+            and bool(torch.isfinite(reference_posterior_samples).all())
+        )
+
+    def _setup_observation(
+        self,
+        num_observation: int,
+        observation_seed: int,
+        create_reference: bool = True,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """Generate and save observation and reference posterior samples for one
+        observation number
+
+        Seeds numpy and torch with `observation_seed`, so the result does not depend
+        on the process it runs in.
+
+        Args:
+            num_observation: Observation number
+            observation_seed: Seed of the observation
+            create_reference: If False, skips reference creation
+            kwargs: Passed to `_sample_reference_posterior`
+
+        Returns:
+            Dict with the acceptance rate of the reference posterior sampling, None
+            if the sampler does not report one
+        """
+        np.random.seed(observation_seed)
+        torch.manual_seed(observation_seed)
+        self._save_observation_seed(num_observation, observation_seed)
+
+        prior = self.get_prior()
+        true_parameters = prior(num_samples=1)
+        self._save_true_parameters(num_observation, true_parameters)
+
+        simulator = self.get_simulator()
+        observation = simulator(true_parameters)
+        self._save_observation(num_observation, observation)
+
+        self.reference_acceptance_rate = None
+        if create_reference:
+            reference_posterior_samples = self._sample_reference_posterior(
+                num_observation=num_observation,
+                num_samples=self.num_reference_posterior_samples,
+                **kwargs,
+            )
+            num_unique = torch.unique(reference_posterior_samples, dim=0).shape[0]
+            assert num_unique == self.num_reference_posterior_samples
+            self._save_reference_posterior_samples(
+                num_observation,
+                reference_posterior_samples,
+            )
+
+        return {"acceptance_rate": self.reference_acceptance_rate}
+
     def _setup(self, n_jobs: int = -1, create_reference: bool = True, **kwargs: Any):
         """Setup the task: generate observations and reference posterior samples
 
         In most cases, you don't need to execute this method, since its results are stored to disk.
 
-        Re-executing will overwrite existing files.
+        Re-executing will overwrite existing files. To regenerate only missing or
+        incomplete observations of several tasks, use the `asbi-setup` command.
 
         Args:
             n_jobs: Number of to use for Joblib
@@ -428,34 +672,10 @@ class Task:
         """
         from joblib import Parallel, delayed
 
-        def run(num_observation, observation_seed, **kwargs):
-            np.random.seed(observation_seed)
-            torch.manual_seed(observation_seed)
-            self._save_observation_seed(num_observation, observation_seed)
-
-            prior = self.get_prior()
-            true_parameters = prior(num_samples=1)
-            self._save_true_parameters(num_observation, true_parameters)
-
-            simulator = self.get_simulator()
-            observation = simulator(true_parameters)
-            self._save_observation(num_observation, observation)
-
-            if create_reference:
-                reference_posterior_samples = self._sample_reference_posterior(
-                    num_observation=num_observation,
-                    num_samples=self.num_reference_posterior_samples,
-                    **kwargs,
-                )
-                num_unique = torch.unique(reference_posterior_samples, dim=0).shape[0]
-                assert num_unique == self.num_reference_posterior_samples
-                self._save_reference_posterior_samples(
-                    num_observation,
-                    reference_posterior_samples,
-                )
-
         Parallel(n_jobs=n_jobs, verbose=50, backend="loky")(
-            delayed(run)(num_observation, observation_seed, **kwargs)
+            delayed(self._setup_observation)(
+                num_observation, observation_seed, create_reference, **kwargs
+            )
             for num_observation, observation_seed in enumerate(
                 self.observation_seeds, start=1
             )
@@ -8,8 +8,8 @@ import torch
 from pyro import distributions as pdist
 
 import sbibm
-from sbibm.tasks.simulator import Simulator
-from sbibm.tasks.task import Task
+from asbi.tasks.simulator import Simulator
+from asbi.tasks.task import Task
 from sbibm.utils.pyro import make_log_prob_grad_fn
 
 
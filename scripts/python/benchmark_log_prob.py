@@ -0,0 +1,47 @@
+import argparse
+import time
+import torch as th
+from asbi.tasks import get_task
+
+def eval_timed(fn, parameters):
+    start = time.time()
+    out = fn(parameters)
+    return out, time.time() - start
+
+def main():
+    # set up argument parser
+    parser = argparse.ArgumentParser(description='benchmark batched pyro log prob and gradient functions against per-row evaluation')
+    parser.add_argument('--tasks', nargs='+', default=['gaussian_linear', 'gaussian_linear_uniform', 'slcp', 'bernoulli_glm', 'sir', 'lotka_volterra'])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[100, 1000])
+    parser.add_argument('--num-observation', type=int, default=1)
+    parser.add_argument('--automatic-transforms', action='store_true',
+                        help='evaluate in the unconstrained space of the prior')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for task_name in args.tasks:
+        task = get_task(task_name)
+        kwargs = dict(num_observation=args.num_observation, automatic_transform_enabled=args.automatic_transforms)
+        log_prob_fn = task._get_log_prob_fn(**kwargs)
+        log_prob_grad_fn = task._get_log_prob_grad_fn(**kwargs)
+
+        for batch_size in args.batch_sizes:
+            th.manual_seed(args.seed)
+            parameters = task.get_prior()(num_samples=batch_size)
+            if args.automatic_transforms:
+                parameters = task._get_transforms(num_observation=args.num_observation)['parameters'](parameters)
+
+            # per-row reference: one row at a time, as before batching
+            rows_log_prob, time_rows = eval_timed(lambda p: th.cat([log_prob_fn(row.reshape(1, -1)) for row in p]), parameters)
+            rows_grad, time_rows_grad = eval_timed(lambda p: th.cat([log_prob_grad_fn(row.reshape(1, -1)) for row in p]), parameters)
+            batched_log_prob, time_batched = eval_timed(log_prob_fn, parameters)
+            batched_grad, time_batched_grad = eval_timed(log_prob_grad_fn, parameters)
+
+            max_error = (batched_log_prob - rows_log_prob).abs().max().item()
+            max_error_grad = (batched_grad - rows_grad).abs().max().item()
+            print(f'{task_name} n={batch_size}: '
+                  f'log prob {time_rows:.2f}s -> {time_batched:.3f}s ({time_rows / time_batched:.0f}x, max abs error {max_error:.1e}), '
+                  f'grad {time_rows_grad:.2f}s -> {time_batched_grad:.3f}s ({time_rows_grad / time_batched_grad:.0f}x, max abs error {max_error_grad:.1e})')
+
+if __name__ == '__main__':
+    main()
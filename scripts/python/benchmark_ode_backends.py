@@ -0,0 +1,52 @@
+import argparse
+import time
+from contextlib import ExitStack
+import torch as th
+from asbi.tasks import get_task
+
+def solve_timed(task, parameters):
+    start = time.time()
+    us = task.solve_ode(parameters)
+    return us, time.time() - start
+
+def main():
+    # set up argument parser
+    parser = argparse.ArgumentParser(description='benchmark the torch ode backend against the julia backend')
+    parser.add_argument('--tasks', nargs='+', default=['sir', 'lotka_volterra'])
+    parser.add_argument('--num-simulations', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--julia-max-simulations', type=int, default=10000,
+                        help='largest number of simulations solved with julia (it solves one trajectory at a time)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for task_name in args.tasks:
+        # the tasks' ode worker pools are shut down when the task is done
+        with ExitStack() as stack:
+            task_torch = stack.enter_context(get_task(task_name, backend='torch'))
+            try:
+                task_julia = stack.enter_context(get_task(task_name, backend='julia'))
+                # the first solve loads julia and compiles the problem, keep it out of the timings
+                _, warmup_time = solve_timed(task_julia, task_julia.prior_dist.mean.reshape(1, -1))
+                print(f'{task_name}: julia warmup {warmup_time:.1f}s')
+            except Exception as e:
+                print(f'{task_name}: julia backend unavailable ({str(e).splitlines()[0]}), benchmarking torch only')
+                task_julia = None
+
+            for num_simulations in args.num_simulations:
+                th.manual_seed(args.seed)
+                parameters = task_torch.get_prior()(num_samples=num_simulations)
+
+                us_torch, time_torch = solve_timed(task_torch, parameters)
+                result = f'{task_name} n={num_simulations}: torch {time_torch:.2f}s ({num_simulations / time_torch:.0f} sims/s)'
+
+                if task_julia is not None and num_simulations <= args.julia_max_simulations:
+                    us_julia, time_julia = solve_timed(task_julia, parameters)
+                    valid = ~(th.isnan(us_torch).flatten(1).any(1) | th.isnan(us_julia).flatten(1).any(1))
+                    rel_error = (us_torch[valid] - us_julia[valid]).abs() / us_julia[valid].abs().clamp(min=1e-6)
+                    result += (f', julia {time_julia:.2f}s ({num_simulations / time_julia:.0f} sims/s)'
+                               f', max rel error {rel_error.max().item():.2e}'
+                               f', nan mismatches {(th.isnan(us_torch).flatten(1).any(1) != th.isnan(us_julia).flatten(1).any(1)).sum().item()}')
+                print(result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import argparse
+from asbi.tasks import get_task, get_available_tasks
+
+def main():
+    # set up argument parser
+    parser = argparse.ArgumentParser(description='prebuild binary caches of task reference data')
+    parser.add_argument('tasks', nargs='*', help='tasks to build caches for (default: all available tasks)')
+    parser.add_argument('--force', action='store_true', help='rebuild caches even if they are valid')
+    args = parser.parse_args()
+
+    task_names = args.tasks if args.tasks else get_available_tasks()
+    for task_name in task_names:
+        try:
+            task = get_task(task_name)
+        except Exception as e:
+            # e.g. ode tasks whose julia backend is not installed
+            print(f'skipping {task_name}: {e}')
+            continue
+        num_built = task.build_binary_caches(force=args.force)
+        print(f'{task_name}: built {num_built} caches')
+
+if __name__ == '__main__':
+    main()
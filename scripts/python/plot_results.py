@@ -0,0 +1,25 @@
+import os
+import argparse
+from asbi.experiments.plot import plot_results
+from asbi.experiments.results import load_results
+
+def main():
+    # set up argument parser
+    parser = argparse.ArgumentParser(description='plot the results (or checkpoint) of an experiment run')
+    parser.add_argument('results_path', help='results file (.csv, .jsonl or .db)')
+    parser.add_argument('plots_dir', nargs='?', default=None,
+                        help='directory to save plots to (default: plots/ next to the results directory)')
+    parser.add_argument('--show', action='store_true')
+    args = parser.parse_args()
+
+    plots_dir = args.plots_dir
+    if plots_dir is None:
+        plots_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(args.results_path))), 'plots')
+    os.makedirs(plots_dir, exist_ok=True)
+
+    results_df = load_results(args.results_path)
+    print(f'loaded {len(results_df)} results from {args.results_path}')
+    plot_results(results_df, plots_dir, show=args.show)
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('config_path')
     parser.add_argument('output_path')
+    parser.add_argument('--resume', metavar='OUTPUT_DIR', default=None,
+                        help='output directory of an interrupted run, completed cells of its checkpoint are skipped')
     args = parser.parse_args()
     
     # setup paths
@@ -23,7 +25,9 @@ def main():
     
     # initialize and run the program
     print('initializing runner...')
-    program = Runner(config, args.output_path)
+    if args.resume is not None:
+        print('resuming run in: ', args.resume)
+    program = Runner(config, args.output_path, output_dir=args.resume)
 
     print('running...')
     program.run()
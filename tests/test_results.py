@@ -0,0 +1,33 @@
+import math
+
+import pandas as pd
+
+from asbi.experiments.results import TIMINGS_COLUMNS, SQLiteResultsWriter, append_timings, read_completed_rows
+
+
+def test_resume_from_sqlite_checkpoint_with_missing_std(tmp_path):
+    # with a single evaluation observation the c2st std is nan, which sqlite stores as NULL
+    writer = SQLiteResultsWriter(str(tmp_path / "results_checkpoint.db"))
+    writer.append({'repeat': 1, 'n_sims': 100, 'method': 'NLE', 'c2st_mean': 0.75, 'c2st_std': float('nan')})
+    writer.append({'repeat': 2, 'n_sims': 100, 'method': 'NLE', 'c2st_mean': 0.7, 'c2st_std': 0.01})
+
+    cells = [(1, 100, 'NLE'), (1, 100, 'BALD_NLE')]
+    rows = read_completed_rows(writer, cells)
+
+    assert len(rows) == 1
+    assert (rows[0]['repeat'], rows[0]['n_sims'], rows[0]['method']) == (1, 100, 'NLE')
+    assert rows[0]['c2st_mean'] == 0.75
+    assert math.isnan(rows[0]['c2st_std'])
+
+
+def test_append_timings_with_peak_memory(tmp_path):
+    path = str(tmp_path / "timings.csv")
+    timings = [{'name': 'cell', 'seconds': 1.5, 'count': 1}, {'name': 'simulations', 'seconds': None, 'count': 100}]
+    append_timings(path, 1, 100, 'NLE', timings, {'max_rss_mb': 512.0, 'max_cuda_mb': None})
+    append_timings(path, 1, 100, 'BALD_NLE', timings, {'max_rss_mb': 768.0, 'max_cuda_mb': 64.0})
+
+    timings_df = pd.read_csv(path)
+    assert list(timings_df.columns) == TIMINGS_COLUMNS
+    assert len(timings_df) == 4
+    assert timings_df.groupby('method')['max_rss_mb'].max().to_dict() == {'BALD_NLE': 768.0, 'NLE': 512.0}
+    assert timings_df['max_cuda_mb'].isna().sum() == 2